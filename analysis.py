@@ -0,0 +1,353 @@
+#!/bin/env python3
+'''Fit the exponential phase of many growth curves at once.
+
+The notebook fits each culture with its own call to scipy's curve_fit. Here all the cultures are padded into one array
+(one row per culture) and fitted together: a log-linear fit gives the starting point in closed form, then a
+Levenberg-Marquardt refinement updates every row at each iteration. The models are those of the notebook:
+    with blank:     od = blank + od_zero * 2 ** (elapsed / tau)
+    without blank:  od = od_zero * 2 ** (elapsed / tau)
+and, as in the notebook, each point is weighted by 1 / od since the noise is roughly proportional to the OD.
+'''
+
+import math
+
+import numpy as np
+
+from record_file import load_record, epoch_seconds
+
+LOG_2 = math.log(2)
+MAX_EXPONENT = 1000 # 2 ** 1000 is about the largest float, larger exponents are clipped
+
+def pad_groups(group_ids, elapsed, ods):
+    '''Arrange the points of each group (culture) into the rows of padded arrays. <group_ids> gives the group number
+    of each point, from 0 to n_groups - 1. Returns (elapsed, ods, mask), of shape (n_groups, longest group), where <mask>
+    is False for the padding.'''
+
+    group_ids = np.asarray(group_ids, dtype = np.intp)
+    order = np.argsort(group_ids, kind = 'stable')
+    sorted_ids = group_ids[order]
+
+    sizes = np.bincount(sorted_ids)
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    columns = np.arange(len(sorted_ids)) - starts[sorted_ids]
+
+    shape = (len(sizes), sizes.max() if len(sizes) else 0)
+    padded_elapsed = np.zeros(shape)
+    padded_ods = np.ones(shape)
+    mask = np.zeros(shape, dtype = bool)
+
+    padded_elapsed[sorted_ids, columns] = np.asarray(elapsed, dtype = np.float64)[order]
+    padded_ods[sorted_ids, columns] = np.asarray(ods, dtype = np.float64)[order]
+    mask[sorted_ids, columns] = True
+
+    return padded_elapsed, padded_ods, mask
+
+def log_linear_fit(elapsed, ods, mask):
+    '''Closed-form fit of log2(od) = log2(od_zero) + elapsed / tau, row by row, on the positive ODs.
+    Since the noise is proportional to the OD, it is about constant on the log scale and the points are not weighted.
+    Returns (od_zero, rate), with rate = 1 / tau.'''
+
+    usable = mask & (ods > 0)
+
+    n = usable.sum(axis = 1)
+    log_signal = np.log2(np.where(usable, ods, 1))
+    x = np.where(usable, elapsed, 0)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean_x = x.sum(axis = 1) / n
+        mean_y = log_signal.sum(axis = 1) / n
+        dx = np.where(usable, elapsed - mean_x[:, None], 0)
+        rate = (dx * (log_signal - mean_y[:, None])).sum(axis = 1) / (dx ** 2).sum(axis = 1)
+        od_zero = 2 ** (mean_y - rate * mean_x)
+
+    return od_zero, rate
+
+def linear_fit(a, b, y):
+    '''Least squares coefficients (p, q) of y = p * a + q * b, row by row.'''
+
+    aa, ab, bb = (a * a).sum(axis = 1), (a * b).sum(axis = 1), (b * b).sum(axis = 1)
+    ay, by = (a * y).sum(axis = 1), (b * y).sum(axis = 1)
+
+    with np.errstate(all = 'ignore'):
+        determinant = aa * bb - ab ** 2
+        return (bb * ay - ab * by) / determinant, (aa * by - ab * ay) / determinant
+
+def fit_exponential(elapsed, ods, mask, with_blank = True, max_iterations = 200, tolerance = 1.5e-8):
+    '''Fit the exponential model to each row of the padded arrays (see pad_groups).
+    The starting point takes the doubling time of the log-linear fit, and the blank and od_zero that fit best with that
+    doubling time, which is a linear problem. The refinement of a row stops when both the actual and the predicted
+    reductions of its cost by an iteration are less than <tolerance> (relative), as curve_fit does.
+    Returns a dict of arrays, one value per row: 'blank' (with <with_blank>), 'od_zero', 'tau', and 'converged'.
+    Rows that cannot be fitted (e.g. too few points) get NaN.'''
+
+    n_rows = len(elapsed)
+    weights = np.where(mask, 1 / np.maximum(ods, 1e-9), 0) # 1 / sigma
+
+    # The amplitude is fitted at the middle of each row rather than at elapsed = 0: far from the data, od_zero and the
+    # rate are strongly correlated, and the refinement crawls along the valley between them
+    with np.errstate(invalid = 'ignore'):
+        middle = np.where(mask, elapsed, 0).sum(axis = 1) / mask.sum(axis = 1)
+    middle = np.where(np.isfinite(middle), middle, 0)
+    elapsed = np.where(mask, elapsed - middle[:, None], 0)
+
+    # Starting point: with the rate fixed, the model is linear in the blank and od_zero
+    od_zero, rate = log_linear_fit(elapsed, ods, mask)
+    rate = np.where(np.isfinite(rate), rate, 0)
+
+    growth = weights * 2 ** np.clip(rate[:, None] * elapsed, -MAX_EXPONENT, MAX_EXPONENT)
+    if with_blank:
+        blank, od_zero = linear_fit(weights, growth, weights * ods)
+    else:
+        with np.errstate(all = 'ignore'):
+            od_zero = (growth * weights * ods).sum(axis = 1) / (growth ** 2).sum(axis = 1)
+
+    # Parameters: [blank,] od_zero, rate
+    params = np.column_stack(([blank] if with_blank else []) + [od_zero, rate])
+    n_params = params.shape[1]
+
+    def residuals_and_jacobian(rows, params):
+        '''Weighted residuals, and their derivatives with respect to each parameter (rows, points, parameters).'''
+
+        row_elapsed, row_weights = elapsed[rows], weights[rows]
+        growth = 2 ** np.clip(params[:, -1:] * row_elapsed, -MAX_EXPONENT, MAX_EXPONENT)
+        model = params[:, -2:-1] * growth
+        if with_blank:
+            model = model + params[:, :1]
+
+        residuals = row_weights * (ods[rows] - model)
+
+        derivatives = [growth, params[:, -2:-1] * row_elapsed * LOG_2 * growth]
+        if with_blank:
+            derivatives.insert(0, np.ones_like(growth))
+        jacobian = row_weights[:, :, None] * np.stack(derivatives, axis = 2)
+
+        return residuals, jacobian
+
+    all_rows = np.arange(n_rows)
+    with np.errstate(all = 'ignore'):
+        residuals, jacobian = residuals_and_jacobian(all_rows, params)
+    cost = (residuals ** 2).sum(axis = 1)
+    damping = np.full(n_rows, 1e-3)
+    active = np.isfinite(params).all(axis = 1) & (mask.sum(axis = 1) > n_params)
+    converged = np.zeros(n_rows, dtype = bool)
+
+    for iteration in range(max_iterations):
+
+        if not active.any():
+            break
+
+        rows = np.flatnonzero(active)
+        normal = np.einsum('rpi,rpj->rij', jacobian[rows], jacobian[rows])
+        gradient = np.einsum('rpi,rp->ri', jacobian[rows], residuals[rows])
+
+        # Marquardt's scaling: damp each parameter relative to its own curvature
+        diagonal = np.einsum('rii->ri', normal)
+        damped = normal + (damping[rows, None] * np.maximum(diagonal, 1e-300))[:, :, None] * np.eye(n_params)
+
+        with np.errstate(all = 'ignore'):
+            try:
+                steps = np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError: # one of the systems is singular: solve them one by one
+                steps = np.array([np.linalg.lstsq(matrix, vector, rcond = None)[0]
+                                  for matrix, vector in zip(damped, gradient)])
+
+            trial = params[rows] + steps
+            trial_residuals, trial_jacobian = residuals_and_jacobian(rows, trial)
+            trial_cost = (trial_residuals ** 2).sum(axis = 1)
+
+            # Reduction of the cost predicted by the linearised model
+            linear_residuals = residuals[rows] - np.einsum('rpi,ri->rp', jacobian[rows], steps)
+            predicted_change = (cost[rows] - (linear_residuals ** 2).sum(axis = 1)) / np.maximum(cost[rows], 1e-300)
+
+        # Accept the steps that reduce the cost, and damp the others more
+        accepted = np.isfinite(trial_cost) & (trial_cost <= cost[rows])
+        better = np.zeros(n_rows, dtype = bool)
+        better[rows] = accepted
+        worse = active & ~better
+
+        relative_change = np.zeros(n_rows)
+        with np.errstate(all = 'ignore'):
+            relative_change[better] = (cost[better] - trial_cost[accepted]) / np.maximum(cost[better], 1e-300)
+        relative_change[better] = np.maximum(relative_change[better], predicted_change[accepted])
+
+        params[better] = trial[accepted]
+        residuals[better] = trial_residuals[accepted]
+        jacobian[better] = trial_jacobian[accepted]
+        cost[better] = trial_cost[accepted]
+        damping[better] /= 10
+        damping[worse] *= 10
+
+        # Stop when the cost no longer decreases, or when no step can decrease it
+        done = (better & (relative_change < tolerance)) | (worse & (damping > 1e10))
+        converged |= done
+        active &= ~done
+
+    result = {}
+    if with_blank:
+        result['blank'] = np.where(converged, params[:, 0], np.nan)
+    with np.errstate(all = 'ignore'):
+        od_zero = params[:, -2] * 2 ** (-params[:, -1] * middle)
+    result['od_zero'] = np.where(converged, od_zero, np.nan)
+    with np.errstate(divide = 'ignore'):
+        result['tau'] = np.where(converged, 1 / params[:, -1], np.nan)
+    result['converged'] = converged
+
+    return result
+
+def refit(elapsed, ods, mask, rows, result):
+    '''Fit the <rows> of the padded arrays with scipy's curve_fit, from the notebook's initial guesses, and store the
+    parameters found in <result> (see fit_exponential).'''
+
+    import warnings
+    from scipy.optimize import curve_fit, OptimizeWarning
+
+    if 'blank' in result:
+        names, initial_guesses = ['blank', 'od_zero', 'tau'], [0, 0, 18]
+        model = lambda elapsed, blank, od_zero, tau: blank + od_zero * 2 ** (elapsed / tau)
+    else:
+        names, initial_guesses = ['od_zero', 'tau'], [0.001, 18]
+        model = lambda elapsed, od_zero, tau: od_zero * 2 ** (elapsed / tau)
+
+    for row in rows:
+        row_elapsed, row_ods = elapsed[row][mask[row]], ods[row][mask[row]]
+        if len(row_ods) <= len(names):
+            continue
+
+        try:
+            with np.errstate(all = 'ignore'), warnings.catch_warnings():
+                warnings.simplefilter('ignore', OptimizeWarning) # the covariance is not used
+                p_opt, _ = curve_fit(model, row_elapsed, row_ods, sigma = np.maximum(row_ods, 1e-9),
+                                     p0 = initial_guesses)
+        except (RuntimeError, ValueError):
+            continue
+
+        for name, value in zip(names, p_opt):
+            result[name][row] = value
+
+def fit_groups(data, groups, elapsed = 'elapsed_raw', od = 'converted_od', with_blank = True):
+    '''Fit every group of a dataframe at once, like the notebook's groupby(groups).apply(fit_exponential_...).
+    Returns a dataframe with one row per group: the <groups> columns, then 'blank' (with <with_blank>), 'od_zero' and
+    'tau'. The groups that the batched fit cannot fit are fitted with curve_fit, like in the notebook; those that still
+    could not be fitted get NaN, and are listed in a warning.'''
+
+    import pandas as pd
+
+    group_ids, keys = pd.factorize(pd.MultiIndex.from_frame(data[groups]) if len(groups) > 1 else data[groups[0]],
+                                   sort = True)
+
+    padded = pad_groups(group_ids, data[elapsed].to_numpy(), data[od].to_numpy())
+    result = fit_exponential(*padded, with_blank = with_blank)
+
+    # The few groups that did not converge are fitted one by one, as the notebook does
+    failed = ~result.pop('converged')
+    if failed.any():
+        refit(*padded, np.flatnonzero(failed), result)
+        failed = np.isnan(result['tau'])
+
+    if failed.any():
+        print(f'Failed fitting the curve for {", ".join(str(key) for key in keys[failed])}')
+
+    table = pd.DataFrame(list(keys) if len(groups) > 1 else {groups[0]: keys}, columns = groups)
+    for name, values in result.items():
+        table[name] = values
+
+    return table
+
+# Steps of the notebook, to analyse record files without it. The times are in minutes since the start of the file.
+
+RECORD_COLUMNS = ['time', 'device', 'channel', 'name', 'converted_od']
+RAW_COLUMNS = ['timestamp', 'device', 'channel', 'converted_od']
+
+def elapsed_minutes(seconds):
+    '''Minutes from the first of the times <seconds> (since the epoch).'''
+
+    return (seconds - seconds.min()) / 60
+
+def read_record(file_path):
+    '''Read the columns needed from one of Bloomie's record files, from its columnar files when they are complete (see
+    record_file.load_record). Returns a dataframe with the columns device, channel, name, converted_od and
+    elapsed_raw.'''
+
+    import pandas as pd
+
+    data = load_record(file_path, RECORD_COLUMNS)
+
+    # The columnar files store the labels as categories and the channels as small integers
+    data = data.astype({'device': str, 'channel': int, 'name': str})
+    data['converted_od'] = pd.to_numeric(data['converted_od'], errors = 'coerce')
+    data['elapsed_raw'] = elapsed_minutes(data.pop('time'))
+    return data
+
+def read_raw(file_path):
+    '''Read a file saved by the readers' backend (a comma-separated file with a title line), like read_record. The
+    cultures are named after their position, e.g. D2C0.'''
+
+    import pandas as pd
+
+    data = pd.read_csv(file_path, sep = ',', skiprows = 1, usecols = RAW_COLUMNS, keep_default_na = False,
+                       dtype = {'timestamp': str, 'device': str, 'channel': int})
+
+    data['converted_od'] = pd.to_numeric(data['converted_od'], errors = 'coerce')
+    data['name'] = 'D' + data['device'] + 'C' + data['channel'].astype(str)
+    data['elapsed_raw'] = elapsed_minutes(epoch_seconds(data.pop('timestamp')))
+    return data[['device', 'channel', 'name', 'converted_od', 'elapsed_raw']]
+
+def crop(data, groups, warmup_time = 45, od_limit = 0.7):
+    '''Leave out the first <warmup_time> minutes, and each culture from the point its OD goes over <od_limit>.'''
+
+    data = data.sort_values(groups + ['elapsed_raw'], ignore_index = True)
+    by_culture = data.groupby(groups, sort = False)['converted_od']
+
+    # The notebook keeps the points before the running maximum of the next OD reaches the limit
+    next_od = by_culture.shift(-1).fillna(data['converted_od'])
+    below_limit = next_od.groupby([data[group] for group in groups], sort = False).cummax() < od_limit
+
+    return data[below_limit & (data['elapsed_raw'] >= warmup_time)].reset_index(drop = True)
+
+def flag_outliers(data, groups, window = 25, deviation_window = 5, threshold = 3):
+    '''Flag the ODs that deviate from the median of the <window> surrounding ones by more than <threshold> times the
+    median deviation of the <deviation_window> surrounding points, as the notebook does. The medians of the ODs are taken
+    with scipy's medfilt, which pads the series with zeros at the edges (<window> must be odd). <data> must be sorted by
+    culture and time. Returns a boolean Series.'''
+
+    from scipy.signal import medfilt
+
+    by_culture = data.groupby(groups, sort = False)['converted_od']
+    medians = by_culture.transform(lambda ods: medfilt(ods.to_numpy(), kernel_size = window))
+    deviations = (data['converted_od'] - medians).abs()
+
+    typical = deviations.groupby([data[group] for group in groups], sort = False) \
+                        .transform(lambda values: values.rolling(deviation_window, center = True, min_periods = 1).median())
+
+    return deviations / typical > threshold
+
+def fit_growth(data, groups, ini_min_od = 0, ini_max_od = 0.05, min_od = 1e-2, max_od = 0.1, od_sync = 0.001):
+    '''The two fits of the notebook, on cropped data without outliers: the exponential with blank on the start of each
+    culture (ODs up to <ini_max_od>), then the exponential without blank on the blanked ODs between <min_od> and
+    <max_od>, with the times shifted so that each culture reaches <od_sync> at t = 0.
+    Returns one row per culture: blank, ini_od_zero, ini_tau, od_zero, tau and t_sync.'''
+
+    def running_max(values):
+        return values.groupby([data[group] for group in groups], sort = False).cummax()
+
+    # Start of the curves, to find the blank
+    running_od = running_max(data['converted_od'])
+    start = data[(running_od <= ini_max_od) & (running_od >= ini_min_od)]
+
+    initial = fit_groups(start, groups, 'elapsed_raw', 'converted_od', with_blank = True)
+    initial = initial.rename(columns = {'od_zero': 'ini_od_zero', 'tau': 'ini_tau'})
+    initial['t_sync'] = initial.ini_tau * np.log2(od_sync / initial.ini_od_zero)
+
+    # Blanked ODs, with synchronised times
+    data = data.merge(initial, on = groups, how = 'left')
+    data['t'] = data['elapsed_raw'] - data['t_sync']
+    data['o'] = data['converted_od'] - data['blank']
+
+    running_o = running_max(data['o'])
+    previous_max = running_max(data.groupby(groups, sort = False)['o'].shift(1))
+    section = data[(running_o <= max_od) & (previous_max > min_od)]
+
+    params = fit_groups(section, groups, 't', 'o', with_blank = False)
+    params['t_sync'] = params.tau * np.log2(od_sync / params.od_zero)
+
+    return initial.drop(columns = 't_sync').merge(params, on = groups, how = 'left')
@@ -0,0 +1,123 @@
+#!/bin/env python3
+'''Analyse all the record files of a folder at once, like the notebook does for one file.
+
+Each file goes through the steps of the notebook: cropping, outlier removal, then the fit with blank on the start of
+the curves and the fit without blank on the blanked ODs. The files are analysed in parallel, one per process, and the
+parameters of all the cultures are written to a single table, with a column for the file. Bloomie's record files
+(.tsv, read from their columnar files when they are complete) and the files saved by the readers' backend (.csv) are
+both read.
+
+Usage: python batch_analysis.py folder [--output group_params.tsv] [--workers 8] [--warmup 45] [--od-limit 0.7]
+Requires pandas and scipy.
+'''
+
+import sys, os
+import argparse
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import analysis
+
+GROUPS = ['device', 'channel', 'name']
+EXTENSIONS = {'.tsv': analysis.read_record, '.csv': analysis.read_raw}
+
+def find_files(folder):
+    '''Record files of <folder>, by name. The tables written by this script are skipped.'''
+
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) \
+            if os.path.splitext(name)[1] in EXTENSIONS and not name.startswith(('group_params', 'timings'))]
+
+def analyse_file(file_path, options):
+    '''Fit the cultures of one file. Returns the table of parameters, and the time taken by each step.'''
+
+    timings = {}
+    start = time.perf_counter()
+
+    data = EXTENSIONS[os.path.splitext(file_path)[1]](file_path)
+    timings['read'] = time.perf_counter() - start
+    rows = len(data)
+
+    step = time.perf_counter()
+    data = analysis.crop(data, GROUPS, options.warmup, options.od_limit)
+    data = data[~analysis.flag_outliers(data, GROUPS, options.medfilt_window, options.outlier_window,
+                                        options.outlier_threshold)].reset_index(drop = True)
+    timings['prepare'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    params = analysis.fit_growth(data, GROUPS, options.ini_min_od, options.ini_max_od, options.min_od, options.max_od,
+                                 options.od_sync)
+    timings['fit'] = time.perf_counter() - step
+
+    params.insert(0, 'file', os.path.basename(file_path))
+    timings['total'] = time.perf_counter() - start
+    timings['rows'] = rows
+
+    return params, timings
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Fit the growth curves of all the record files of a folder.')
+    parser.add_argument('folder')
+    parser.add_argument('--output', help = 'table of parameters (default: group_params_<folder>.tsv in the folder)')
+    parser.add_argument('--timings', help = 'also write the time taken by each file to this table')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'number of processes')
+    parser.add_argument('--warmup', type = float, default = 45, help = 'min, left out at the start of each file')
+    parser.add_argument('--od-limit', type = float, default = 0.7, help = 'cultures are cropped when they reach it')
+    parser.add_argument('--medfilt-window', type = int, default = 25, help = 'measurements (odd), for the outliers')
+    parser.add_argument('--outlier-window', type = int, default = 5, help = 'measurements, for the median deviation')
+    parser.add_argument('--outlier-threshold', type = float, default = 3)
+    parser.add_argument('--ini-min-od', type = float, default = 0, help = 'range of ODs for the fit with blank')
+    parser.add_argument('--ini-max-od', type = float, default = 0.05)
+    parser.add_argument('--min-od', type = float, default = 1e-2, help = 'range of blanked ODs for the final fit')
+    parser.add_argument('--max-od', type = float, default = 0.1)
+    parser.add_argument('--od-sync', type = float, default = 0.001, help = 'the curves reach it at t = 0')
+    options = parser.parse_args()
+
+    import pandas as pd
+
+    files = find_files(options.folder)
+    if not files:
+        sys.exit(f'No record files in {options.folder}.')
+
+    output = options.output or os.path.join(options.folder,
+                                            f'group_params_{os.path.basename(os.path.abspath(options.folder))}.tsv')
+
+    print(f'Analysing {len(files)} files with {min(options.workers, len(files))} processes.')
+    start = time.perf_counter()
+
+    tables = []
+    timings = []
+    with ProcessPoolExecutor(max_workers = min(options.workers, len(files))) as pool:
+        futures = {pool.submit(analyse_file, file_path, options): file_path for file_path in files}
+
+        for future in as_completed(futures):
+            name = os.path.basename(futures[future])
+            try:
+                params, file_timings = future.result()
+            except Exception:
+                print(f'\nWarning: could not analyse {name}:')
+                traceback.print_exc()
+                continue
+
+            tables.append(params)
+            timings.append({'file': name, **file_timings})
+            print(f"{name}: {file_timings['rows']} rows, {len(params)} cultures in {file_timings['total']:.2f}s "
+                  f"(read {file_timings['read']:.2f}s, prepare {file_timings['prepare']:.2f}s, fit {file_timings['fit']:.2f}s)")
+
+    if not tables:
+        sys.exit('No file could be analysed.')
+
+    params = pd.concat(tables, ignore_index = True).sort_values(['file'] + GROUPS, ignore_index = True)
+    params.to_csv(output, sep = '\t', index = False)
+
+    if options.timings:
+        pd.DataFrame(timings).sort_values('file').to_csv(options.timings, sep = '\t', index = False)
+
+    elapsed = time.perf_counter() - start
+    busy = sum(file_timings['total'] for file_timings in timings)
+    print(f'Wrote the parameters of {len(params)} cultures to {output} in {elapsed:.1f}s '
+          f'({busy:.1f}s of work, {busy / elapsed:.1f} processes busy on average).')
+
+if __name__ == "__main__":
+    main()
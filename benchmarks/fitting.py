@@ -0,0 +1,119 @@
+#!/bin/env python3
+'''Compare the batched exponential fit of analysis.py with the notebook's fit, one curve_fit call per culture.
+
+Simulated exponential phases are fitted both ways, with and without blank, and the script reports the time taken and
+the largest difference between the doubling times found. Requires pandas and scipy.
+
+Usage: python benchmarks/fitting.py [--cultures 96 384] [--points 300]
+'''
+
+import sys, os
+import argparse
+import time
+import warnings
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+from analysis import fit_groups
+
+def simulate(cultures, points, with_blank, seed = 0):
+    '''Exponential phases of <cultures> cultures, of about <points> measurements each, every minute, with noise
+    proportional to the OD. With <with_blank>, the ODs include a blank, otherwise it was already subtracted.'''
+
+    generator = np.random.default_rng(seed)
+    frames = []
+
+    for i in range(cultures):
+        n = int(points * generator.uniform(0.5, 1))
+        elapsed = np.arange(n, dtype = float)
+        blank = generator.uniform(-0.0005, 0.0005) if with_blank else 0
+        od_zero = generator.uniform(0.002, 0.005)
+        tau = generator.uniform(20, 60)
+
+        ods = blank + od_zero * 2 ** (elapsed / tau)
+        ods *= 1 + generator.normal(0, 0.02, n)
+        frames.append(pd.DataFrame({'well': f'W{i:04d}', 'elapsed_raw': elapsed, 'converted_od': ods}))
+
+    return pd.concat(frames, ignore_index = True)
+
+def simulate_starts(cultures, seed = 0):
+    '''Starts of growth curves, as fitted to find the blank: 12 measurements every minute from 45 min, with a large blank.
+    Far from elapsed = 0 and with so few points, od_zero and tau are hard to tell apart, and the fits converge slowly.'''
+
+    generator = np.random.default_rng(seed)
+    frames = []
+
+    for i in range(cultures):
+        elapsed = 45 + np.arange(12.)
+        blank = generator.uniform(0.02, 0.035)
+        od_zero = generator.uniform(0.001, 0.0015)
+        tau = generator.uniform(10, 15)
+
+        ods = blank + od_zero * 2 ** (elapsed / tau)
+        ods *= 1 + generator.normal(0, 0.01, len(elapsed))
+        frames.append(pd.DataFrame({'well': f'W{i:04d}', 'elapsed_raw': elapsed, 'converted_od': ods}))
+
+    return pd.concat(frames, ignore_index = True)
+
+# The notebook's fit
+def exponential_with_blank(elapsed, blank, od_zero, tau):
+    return blank + od_zero * 2 ** (elapsed / tau)
+
+def exponential_without_blank(elapsed, od_zero, tau):
+    return od_zero * 2 ** (elapsed / tau)
+
+def notebook_fit(data, with_blank):
+
+    model = exponential_with_blank if with_blank else exponential_without_blank
+    initial_guesses = [0, 0, 18] if with_blank else [0.001, 18]
+    names = ['blank', 'od_zero', 'tau'] if with_blank else ['od_zero', 'tau']
+
+    def fit(group):
+        sigmas = np.maximum(group['converted_od'], 1e-9)
+        try:
+            p_opt, _ = curve_fit(model, group['elapsed_raw'], group['converted_od'], sigma = sigmas, p0 = initial_guesses)
+        except RuntimeError:
+            p_opt = [np.nan] * len(names)
+        return pd.Series(dict(zip(names, p_opt)))
+
+    return data.groupby(['well']).apply(fit, include_groups = False).reset_index()
+
+def timed(function, *args, **kwargs):
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Compare the batched fit with one curve_fit per culture.')
+    parser.add_argument('--cultures', type = int, nargs = '+', default = [96, 384])
+    parser.add_argument('--points', type = int, default = 300, help = 'most measurements per culture')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore') # curve_fit's covariance warnings
+
+    def compare(description, data, with_blank):
+
+        reference, reference_time = timed(notebook_fit, data, with_blank)
+        batched, batched_time = timed(fit_groups, data, ['well'], with_blank = with_blank)
+
+        difference = np.nanmax(np.abs(batched.tau - reference.tau) / reference.tau)
+        print(f"{description}: curve_fit {reference_time:.3f}s ({reference.tau.isna().sum()} failed), "
+              f"batched {batched_time:.3f}s ({batched.tau.isna().sum()} failed), "
+              f"{reference_time / batched_time:.0f}x faster, largest difference of tau {100 * difference:.2g}%")
+
+    for cultures in args.cultures:
+        for with_blank in [True, False]:
+            compare(f"{cultures} cultures, {'with' if with_blank else 'without'} blank",
+                    simulate(cultures, args.points, with_blank), with_blank)
+
+        compare(f'{cultures} starts of curves, with blank', simulate_starts(cultures), True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/bin/env python3
+'''Measure the time to redraw the plots of the Measurement tab during a long experiment.
+
+The cultures are filled with <points> simulated measurements each, then each frame adds one measurement to every
+culture and redraws the plots, as during a recording. Reports the frame time for each history length, split between
+updating the plots and painting them. The window is drawn offscreen unless QT_QPA_PLATFORM is set; offscreen painting
+is done in software, and is much slower than on screen.
+
+Usage: python benchmarks/plotting.py [--devices 8] [--channels 16] [--points 1000 100000] [--frames 50]
+'''
+
+import sys, os
+import argparse
+import statistics
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+os.chdir(REPO) # to find the default configuration
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+
+import mem
+import main as bloomie
+from recording import culture
+from simulator import culture_model
+
+INTERVAL = 10 # s, simulated time between measurements
+
+def fill_cultures(devices, channels, points):
+    '''Cultures of simulated measurements, every INTERVAL seconds until now.'''
+
+    mem.devices = [str(device + 1) for device in range(devices)]
+    mem.channels = list(range(channels))
+    mem.active_devices = list(mem.devices)
+    mem.cultures = {}
+
+    elapsed = INTERVAL * np.arange(points)
+    times = time.time() - points * INTERVAL + elapsed
+    generator = np.random.default_rng(0)
+
+    for device in mem.devices:
+        mem.cultures[device] = []
+        for channel in mem.channels:
+
+            # Same growth curves as the simulator, computed at once
+            model = culture_model(f'{device}.{channel}')
+            growth = np.exp(-model.growth_rate * elapsed)
+            ods = model.carrying_capacity / (1 + (model.carrying_capacity / model.od_zero - 1) * growth)
+            ods += generator.normal(0, model.noise, points)
+
+            mem.cultures[device].append(culture(f'D{device}C{channel}'))
+            mem.cultures[device][channel].extend(times, ods)
+
+def measure_frames(window, frames):
+    '''Time of each frame, adding one point to every culture then redrawing. Returns the times spent updating the
+    plots (draw_plots) and painting them (Qt).'''
+
+    updates, paints = [], []
+    for frame in range(frames):
+        for device in mem.active_devices:
+            for channel in mem.channels:
+                cell = mem.cultures[device][channel]
+                cell.append(cell.times[-1] + INTERVAL, cell.ods[-1])
+
+        start = time.perf_counter()
+        window.draw_plots()
+        updated = time.perf_counter()
+        QApplication.processEvents() # paint
+        updates.append(updated - start)
+        paints.append(time.perf_counter() - updated)
+
+    return updates, paints
+
+def describe(durations):
+
+    durations = sorted(durations)
+    p95 = durations[int(0.95 * (len(durations) - 1))]
+    return f'median {1e3 * statistics.median(durations):.1f}ms, p95 {1e3 * p95:.1f}ms'
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Measure the redraw time of the plots.')
+    parser.add_argument('--devices', type = int, default = 8)
+    parser.add_argument('--channels', type = int, default = 16)
+    parser.add_argument('--points', type = int, nargs = '+', default = [1000, 100000], help = 'measurements per culture')
+    parser.add_argument('--frames', type = int, default = 50)
+    args = parser.parse_args()
+
+    mem.config['auto_connect'] = False
+    app = QApplication(sys.argv)
+    mem.main_window = bloomie.OD_reader_app()
+    mem.main_window.resize(1600, 900)
+    mem.main_window.show()
+    mem.main_window.tabs.setTabEnabled(1, True)
+    mem.main_window.tabs.setCurrentIndex(1)
+
+    print(f'{args.devices} devices x {args.channels} channels, {args.frames} frames per history length')
+    for points in args.points:
+        fill_cultures(args.devices, args.channels, points)
+        mem.main_window.initialize_plots()
+        mem.main_window.draw_plots() # first drawing of the whole history
+
+        updates, paints = measure_frames(mem.main_window, args.frames)
+        frames = [update + paint for update, paint in zip(updates, paints)]
+        print(f'{points} points per culture: frame {describe(frames)} (update {describe(updates)}, '
+              f'paint {describe(paints)})')
+
+if __name__ == "__main__":
+    main()
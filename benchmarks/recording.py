@@ -0,0 +1,130 @@
+#!/bin/env python3
+'''Measure the sustained throughput of the recorder, receiving from the simulated backend faster than real time.
+
+For each speed, the simulator runs in its own process (so that it does not compete with the recorder for the
+interpreter), and the headless recorder records all its channels for <duration> seconds. Reports the readings received
+per second against the rate sent, the latencies of each stage, and the largest backlog of the readings queue.
+
+Usage: python benchmarks/recording.py [--devices 8] [--channels 16] [--interval 10] [--speeds 10 100] [--duration 20]
+'''
+
+import sys, os
+import argparse
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+os.chdir(REPO) # to find the default configuration
+
+import mem
+import diagnostics
+import ingestion
+import record_file
+from recording import recorder
+
+USER = 'benchmark'
+STANDARD_CURVE = 'benchmark'
+
+def free_port():
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def start_simulator(devices, channels, speed):
+    '''Start the simulator in a new process, and wait until it answers.'''
+
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO, 'simulator.py'), '--port', str(port),
+                                '--devices', str(devices), '--channels', str(channels), '--speed', str(speed),
+                                '--users', USER], stdout = subprocess.DEVNULL)
+
+    for attempt in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout = 0.1).close()
+            return process, f'127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.05)
+
+    process.kill()
+    raise RuntimeError('The simulator did not start.')
+
+def run(devices, channels, interval, speed, duration, folder):
+    '''Record from a simulator at <speed> for <duration> seconds. Returns the results as a dict.'''
+
+    process, address = start_simulator(devices, channels, speed)
+
+    try:
+        mem.hosts = [address]
+        ingestion.set_devices(ingestion.connect_to_hosts(mem.hosts, USER, mem.config['connection_timeout']))
+
+        mem.active_devices = []
+        mem.recorder = recorder()
+        mem.recorder.initialize_cultures({(device, channel): f'{device}_{channel}' for device in mem.devices \
+                                          for channel in mem.channels})
+
+        mem.file_path = os.path.join(folder, f'speed_{speed:g}.tsv')
+        record_file.create_record(mem.file_path)
+        mem.recorder.start_backend(STANDARD_CURVE, interval, 'benchmark')
+
+        mem.running = True
+        thread = threading.Thread(target = mem.recorder.record)
+        thread.start()
+
+        # Let the pipeline settle, then measure
+        time.sleep(min(2, duration / 4))
+        start_time = time.monotonic()
+        start_readings = diagnostics.counters['readings'].total if 'readings' in diagnostics.counters else 0
+
+        max_backlog = 0
+        while time.monotonic() - start_time < duration:
+            time.sleep(0.1)
+            max_backlog = max(max_backlog, mem.recorder.readings.qsize())
+
+        elapsed = time.monotonic() - start_time
+        received = diagnostics.counters['readings'].total - start_readings
+        snapshot = diagnostics.snapshot()
+
+        mem.running = False
+        thread.join()
+        ingestion.close_hosts()
+
+    finally:
+        process.kill()
+        process.wait()
+
+    return {'sent_per_s': devices * channels * speed / interval, 'received_per_s': received / elapsed,
+            'max_backlog': max_backlog, 'timings': snapshot['timings']}
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Measure the throughput of the recorder against the simulator.')
+    parser.add_argument('--devices', type = int, default = 8)
+    parser.add_argument('--channels', type = int, default = 16)
+    parser.add_argument('--interval', type = int, default = 10, help = 's, simulated time between measurements')
+    parser.add_argument('--speeds', type = float, nargs = '+', default = [10, 100])
+    parser.add_argument('--duration', type = float, default = 20, help = 's, measuring time at each speed')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for speed in args.speeds:
+            results[speed] = run(args.devices, args.channels, args.interval, speed, args.duration, folder)
+
+    print(f'\n{args.devices} devices x {args.channels} channels, {args.interval}s interval, {args.duration:g}s per speed')
+    for speed, result in results.items():
+        print(f"\nSpeed {speed:g}x: {result['received_per_s']:.0f} readings/s received "
+              f"({result['sent_per_s']:.0f}/s sent), largest backlog {result['max_backlog']} frames")
+
+        for stage in ['decode', 'process', 'file_write']:
+            summary = result['timings'].get(stage, {'count': 0})
+            if summary['count']:
+                print(f"  {stage:<11} p50 {summary['p50_ms']:7.3f}ms  p95 {summary['p95_ms']:7.3f}ms  "
+                      f"p99 {summary['p99_ms']:7.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/bin/env python3
+'''Measure how long the window takes to appear, and the peak memory used by then.
+
+Each run starts a fresh interpreter that opens the window (without connecting to the devices) and reports when it is
+shown. The time includes starting Python itself.
+
+Usage: python benchmarks/startup.py [--runs 5]
+'''
+
+import sys, os
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that should only be imported when they are needed
+HEAVY_MODULES = ['pandas', 'pyarrow', 'requests', 'websocket', 'odmeter_api']
+
+CHILD = '''
+import sys, os, time, json, resource
+sys.path.insert(0, {repo!r})
+os.chdir({repo!r})
+import mem
+mem.config['auto_connect'] = False
+from PyQt5.QtWidgets import QApplication
+import main
+app = QApplication(sys.argv)
+mem.main_window = main.OD_reader_app()
+mem.main_window.show()
+app.processEvents()
+shown = time.time()
+print(json.dumps({{'shown': shown, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'heavy_modules': [module for module in {heavy!r} if module in sys.modules]}}))
+'''
+
+def run_once():
+    '''Time to window (s), peak RSS (MB), and heavy modules loaded, for one fresh process.'''
+
+    code = CHILD.format(repo = REPO, heavy = HEAVY_MODULES)
+    environment = dict(os.environ, QT_QPA_PLATFORM = os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+
+    start = time.time()
+    output = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, env = environment,
+                            check = True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    return result['shown'] - start, result['max_rss_kb'] / 1024, result['heavy_modules']
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Measure the startup time and memory of the window.')
+    parser.add_argument('--runs', type = int, default = 5)
+    args = parser.parse_args()
+
+    times, memory = [], []
+    for run in range(args.runs):
+        seconds, megabytes, heavy_modules = run_once()
+        times.append(seconds)
+        memory.append(megabytes)
+        print(f'Run {run + 1}: window shown after {seconds:.2f}s, peak RSS {megabytes:.0f} MB')
+
+    print(f'\nTime to window: median {statistics.median(times):.2f}s, min {min(times):.2f}s')
+    print(f'Peak RSS: median {statistics.median(memory):.0f} MB')
+    print(f'Heavy modules imported at startup: {", ".join(heavy_modules) or "none"}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/bin/env python3
+'''Measure where the time goes in the recording pipeline. The readers, the recorder, the file writer and the plots
+record latencies and counts here; the diagnostics panel and the diagnostics file show snapshots of them.'''
+
+import json
+import math
+import os
+import threading
+import time
+
+class histogram:
+    '''Latency histogram with logarithmic buckets (10 per decade, from 1 µs to 100 s). Recording is O(1), and the
+    quantiles are accurate to the width of a bucket (about 25%).'''
+
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+
+    FIRST = 1e-6 # s, upper edge of the first bucket
+    PER_DECADE = 10
+    N_BUCKETS = 80
+
+    def __init__(self):
+        self.counts = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.maximum = 0.
+
+    def record(self, seconds):
+
+        if seconds > self.FIRST:
+            bucket = min(int(math.log10(seconds / self.FIRST) * self.PER_DECADE) + 1, self.N_BUCKETS - 1)
+        else:
+            bucket = 0
+
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def quantile(self, q):
+        '''Upper edge of the bucket containing the <q> quantile, in seconds.'''
+
+        rank = q * self.count
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.FIRST * 10 ** (bucket / self.PER_DECADE), self.maximum)
+
+        return self.maximum
+
+    def summary(self):
+        '''Count, and mean, median, 95th, 99th percentiles and maximum in milliseconds.'''
+
+        if not self.count:
+            return {'count': 0}
+
+        return {'count': self.count, 'mean_ms': 1e3 * self.total / self.count, 'p50_ms': 1e3 * self.quantile(0.5),
+                'p95_ms': 1e3 * self.quantile(0.95), 'p99_ms': 1e3 * self.quantile(0.99), 'max_ms': 1e3 * self.maximum}
+
+class counter:
+    '''Running total, and its rate since the previous snapshot.'''
+
+    __slots__ = ('total', 'last_total', 'last_time')
+
+    def __init__(self):
+        self.total = 0
+        self.last_total = 0
+        self.last_time = time.monotonic()
+
+    def add(self, n = 1):
+        self.total += n
+
+    def summary(self):
+
+        now = time.monotonic()
+        rate = (self.total - self.last_total) / (now - self.last_time) if now > self.last_time else 0.
+        self.last_total, self.last_time = self.total, now
+
+        return {'total': self.total, 'per_s': rate}
+
+# Some metrics are updated from several threads (e.g. decode, by the reader of each host), and the snapshots are
+# taken from another one: the metrics are only updated and read with the lock held
+timings = {}
+counters = {}
+gauges = {} # functions returning a current value, e.g. the length of a queue
+
+_lock = threading.Lock()
+
+def record(name, seconds):
+    '''Add a latency to the <name> histogram.'''
+
+    with _lock:
+        entry = timings.get(name)
+        if entry is None:
+            entry = timings[name] = histogram()
+
+        entry.record(seconds)
+
+def count(name, n = 1):
+    '''Add <n> to the <name> counter.'''
+
+    with _lock:
+        entry = counters.get(name)
+        if entry is None:
+            entry = counters[name] = counter()
+
+        entry.add(n)
+
+def gauge(name, function):
+    '''Report the value returned by <function> in the snapshots.'''
+
+    gauges[name] = function
+
+def reset():
+    '''Forget all the measurements, e.g. when a new recording starts.'''
+
+    with _lock:
+        timings.clear()
+        counters.clear()
+        gauges.clear()
+
+def snapshot():
+    '''Summary of all the metrics, as a dictionary that can be written as JSON.'''
+
+    with _lock:
+        return {'time': time.time(),
+                'timings': {name: entry.summary() for name, entry in sorted(timings.items())},
+                'counters': {name: entry.summary() for name, entry in sorted(counters.items())},
+                'gauges': {name: function() for name, function in sorted(gauges.items())}}
+
+def format_snapshot(data):
+    '''Human-readable version of a snapshot, one metric per line.'''
+
+    lines = []
+    for name, summary in data['timings'].items():
+        if summary['count']:
+            lines.append(f"{name:<16} n={summary['count']:<8} mean={summary['mean_ms']:8.2f}ms  "
+                         f"p50={summary['p50_ms']:8.2f}ms  p95={summary['p95_ms']:8.2f}ms  "
+                         f"p99={summary['p99_ms']:8.2f}ms  max={summary['max_ms']:8.2f}ms")
+
+    for name, summary in data['counters'].items():
+        lines.append(f"{name:<16} total={summary['total']:<10} {summary['per_s']:10.1f}/s")
+
+    for name, value in data['gauges'].items():
+        lines.append(f"{name:<16} {value}")
+
+    return '\n'.join(lines)
+
+def dump(file_path, data):
+    '''Write a snapshot to <file_path> as JSON. The file is replaced atomically, so readers never see it half-written.'''
+
+    temporary_path = file_path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(data, file, indent = 1)
+
+    os.replace(temporary_path, file_path)
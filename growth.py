@@ -0,0 +1,121 @@
+#!/bin/env python3
+'''Live estimation of the growth rate of the cultures, as the measurements arrive.
+
+This is the forward pass of the notebook's run_rts_smoother: an extended Kalman filter whose state is the OD and the
+growth rate (doublings per minute), the OD growing as OD * 2 ** (growth_rate * dt) between measurements. Without the
+backward smoothing pass, each measurement costs a constant time, whatever the length of the experiment. The filter works
+on the OD as measured, since the blank is only known after fitting the whole curve.
+'''
+
+import math
+
+import numpy as np
+
+class growth_filter:
+    '''Kalman filters of <n> cultures, updated together. Culture i has its state in element i of the arrays.
+    <doubling_time> (min) is the initial estimate, <growth_rate_drift> the variance of the change of the growth rate
+    between two measurements, and <od_noise> the variance of the OD measurements (see the notebook).'''
+
+    def __init__(self, n, doubling_time = 30, growth_rate_drift = 1e-8, od_noise = 1e-5, od_variance = 1e-8,
+                 growth_rate_variance = 1.8e-7):
+
+        self.initial_growth_rate = 1 / doubling_time
+        self.growth_rate_drift = growth_rate_drift
+        self.od_noise = od_noise
+        self.od_variance = od_variance
+        self.growth_rate_variance = growth_rate_variance
+
+        # State and covariance (symmetric, so only three terms are kept)
+        self.ods = np.zeros(n)
+        self.growth_rates = np.full(n, self.initial_growth_rate)
+        self.p_od = np.full(n, od_variance)
+        self.p_cross = np.zeros(n)
+        self.p_growth = np.full(n, growth_rate_variance)
+        self.times = np.full(n, np.nan) # s, time of the last measurement (NaN before the first)
+
+    def update(self, indices, times, ods):
+        '''Add the measurements (<times> in seconds, <ods>) of the cultures <indices>, given as arrays. A culture can
+        appear several times, in time order. Returns the filtered ODs and growth rates after each measurement.'''
+
+        indices = np.asarray(indices, dtype = np.intp)
+        times = np.asarray(times, dtype = np.float64)
+        ods = np.asarray(ods, dtype = np.float64)
+
+        filtered_ods = np.empty(len(indices))
+        filtered_growth_rates = np.empty(len(indices))
+
+        # Rank of each measurement among the ones of its culture: measurements of the same rank are for different
+        # cultures, and are filtered together
+        order = np.argsort(indices, kind = 'stable')
+        sorted_indices = indices[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(indices)])
+        ranks = np.empty(len(indices), dtype = np.intp)
+        ranks[order] = np.arange(len(indices)) - np.repeat(group_starts, group_sizes)
+
+        by_rank = np.argsort(ranks, kind = 'stable')
+        bounds = np.r_[0, np.cumsum(np.bincount(ranks))] if len(ranks) else [0]
+
+        for rank in range(len(bounds) - 1):
+            positions = by_rank[bounds[rank]:bounds[rank + 1]]
+            filtered_ods[positions], filtered_growth_rates[positions] = self.step(indices[positions], times[positions],
+                                                                                 ods[positions])
+
+        return filtered_ods, filtered_growth_rates
+
+    def step(self, indices, times, ods):
+        '''One measurement for each of the cultures <indices> (all different).'''
+
+        # Measurements without a valid OD (missing or NaN) leave the filters of their cultures as they were
+        valid = np.isfinite(ods)
+        if not valid.all():
+            od, growth_rate = self.ods[indices], self.growth_rates[indices]
+            od[valid], growth_rate[valid] = self.step(indices[valid], times[valid], ods[valid])
+            return od, growth_rate
+
+        od = self.ods[indices]
+        growth_rate = self.growth_rates[indices]
+        p_od, p_cross, p_growth = self.p_od[indices], self.p_cross[indices], self.p_growth[indices]
+
+        # The first measurement of a culture starts its filter
+        first = np.isnan(self.times[indices])
+        od[first] = ods[first]
+        growth_rate[first] = self.initial_growth_rate
+        p_od[first] = self.od_variance
+        p_cross[first] = 0
+        p_growth[first] = self.growth_rate_variance
+
+        dt = np.where(first, 0, (times - self.times[indices]) / 60) # min
+
+        # Prediction, and its Jacobian [[growth, slope], [0, 1]]
+        growth = 2 ** (growth_rate * dt)
+        predicted_od = od * growth
+        slope = predicted_od * dt * math.log(2)
+
+        predicted_p_od = growth ** 2 * p_od + 2 * growth * slope * p_cross + slope ** 2 * p_growth
+        predicted_p_cross = growth * p_cross + slope * p_growth
+        predicted_p_growth = p_growth + np.where(first, 0, self.growth_rate_drift)
+
+        # Correction by the measured OD
+        gain_od = predicted_p_od / (predicted_p_od + self.od_noise)
+        gain_growth = predicted_p_cross / (predicted_p_od + self.od_noise)
+        innovation = ods - predicted_od
+
+        od = predicted_od + gain_od * innovation
+        growth_rate = growth_rate + gain_growth * innovation
+
+        self.ods[indices] = od
+        self.growth_rates[indices] = growth_rate
+        self.p_od[indices] = (1 - gain_od) * predicted_p_od
+        self.p_cross[indices] = (1 - gain_od) * predicted_p_cross
+        self.p_growth[indices] = predicted_p_growth - gain_growth * predicted_p_cross
+        self.times[indices] = times
+
+        return od, growth_rate
+
+def doubling_times(growth_rates):
+    '''Doubling times (min) of growth rates (doublings per minute). NaN when the culture is not growing.'''
+
+    growth_rates = np.asarray(growth_rates, dtype = np.float64)
+    with np.errstate(divide = 'ignore'):
+        return np.where(growth_rates > 0, 1 / growth_rates, np.nan)
@@ -0,0 +1,123 @@
+#!/bin/env python3
+'''Record without a window, e.g. on a small computer next to the readers. Qt is never imported.
+
+The experiment is described in a YAML file:
+
+    hosts: [10.0.0.1:8080] # addresses of the reader hosts
+    username: me
+    experiment_name: my_experiment
+    file: ~/data/my_experiment.tsv
+    interval: 30 # s
+    standard_curve: my_curve
+    append: False # append to the file if it exists (otherwise, refuse to overwrite it)
+    reactors: reactors.tsv # or, for each device, the list of the names of its channels
+
+The reactors file is laid out like the table of the Setup tab: a header with the names of the devices, then one row
+per channel, with the name of each culture. Empty cells are not recorded.
+
+Usage: python headless.py experiment.yaml (stop with Ctrl-C)
+'''
+
+import sys, os
+import argparse
+import signal
+import threading
+import time
+
+import yaml
+
+import mem
+import diagnostics
+import ingestion
+import record_file
+from recording import recorder
+
+def read_reactors(reactors, folder = '.'):
+    '''Labels of the cultures, as a dict of (device, channel): name. <reactors> is either the path of a tab-separated
+    file (relative to <folder>), or a dict of device: list of names.'''
+
+    if isinstance(reactors, str):
+        with open(os.path.join(folder, os.path.expanduser(reactors)), 'r') as file:
+            rows = [line.rstrip('\n').split('\t') for line in file if line.strip()]
+
+        devices = rows[0]
+        return {(device, channel): row[column].strip() for channel, row in enumerate(rows[1:]) \
+                for column, device in enumerate(devices) if column < len(row)}
+
+    return {(str(device), channel): name or '' for device, names in reactors.items() \
+            for channel, name in enumerate(names)}
+
+def dump_diagnostics():
+    '''Write the timings to the diagnostics file until the recording stops.'''
+
+    while mem.running:
+        time.sleep(mem.config['diagnostics_interval'])
+        try:
+            diagnostics.dump(os.path.expanduser(mem.config['diagnostics_file']), diagnostics.snapshot())
+        except OSError as error:
+            print(f'\nWarning: could not write the diagnostics file: {error}')
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Record the OD readers without a window.')
+    parser.add_argument('experiment', help = 'YAML file describing the experiment')
+    args = parser.parse_args()
+
+    with open(args.experiment, 'r') as file:
+        experiment = yaml.safe_load(file)
+
+    # Connect to the hosts
+    mem.hosts = list(dict.fromkeys(experiment['hosts']))
+    mem.experiment_name = experiment['experiment_name']
+
+    print(f'Connecting to {", ".join(mem.hosts)}.')
+    ingestion.set_devices(ingestion.connect_to_hosts(mem.hosts, experiment['username'], mem.config['connection_timeout']))
+
+    # Find the cultures to record
+    labels = read_reactors(experiment['reactors'], os.path.dirname(os.path.abspath(args.experiment)))
+
+    for device in {device for device, channel in labels} - set(mem.devices):
+        print(f'\nWarning: device {device} is not connected, its cultures will not be recorded.')
+
+    mem.recorder = recorder()
+    mem.recorder.initialize_cultures(labels)
+
+    if not mem.active_devices:
+        sys.exit('No culture to record.')
+
+    # Prepare the record file
+    mem.file_path = os.path.expanduser(experiment['file'])
+
+    if os.path.exists(mem.file_path):
+        if not experiment.get('append', False):
+            sys.exit(f'{mem.file_path} already exists. Set "append: True" to add the new data to it.')
+
+        print(f'New data will be appended to {mem.file_path}.')
+        mem.recorder.resume = True
+
+    else:
+        record_file.create_record(mem.file_path)
+
+    # Stop cleanly on Ctrl-C or when the service is stopped, even while the backend is starting
+    mem.running = True
+
+    def stop(signal_number, frame):
+        print('Stopping the recording.')
+        mem.running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        mem.recorder.start_backend(experiment['standard_curve'], int(experiment['interval']), mem.experiment_name)
+
+        if mem.config['diagnostics_file']:
+            threading.Thread(target = dump_diagnostics, daemon = True).start()
+
+        mem.recorder.record()
+
+    finally:
+        ingestion.close_hosts()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/bin/env python3
+'''Connect to several reader hosts, and receive their readings at the same time.'''
+
+import json
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import mem
+import diagnostics
+from record_file import parse_time
+
+# requests, websocket and the API are imported on first use, so that the window appears sooner
+
+try: # optional, fastest: decodes the frames straight into reading records
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try: # optional, faster than the standard library
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+if msgspec is not None:
+
+    class reading(msgspec.Struct):
+        '''Measurement of one reactor. The channel is one-indexed, as in the backend.'''
+
+        t: str
+        device: str
+        channel: int
+        converted_od: Optional[float]
+        intensity: Optional[float] = None
+        intensity_blank: Optional[float] = None
+        raw_od: Optional[float] = None
+
+    class frame(msgspec.Struct):
+        readings: list[reading]
+
+    _decoder = msgspec.json.Decoder(frame, strict = False) # strict = False accepts numbers sent as strings
+
+    def decode_frame(raw_data):
+        '''Read the readings of a websocket frame.'''
+
+        return _decoder.decode(raw_data).readings
+
+    DECODE_ERRORS = (msgspec.DecodeError,)
+
+else:
+
+    class reading:
+        '''Measurement of one reactor. The channel is one-indexed, as in the backend.'''
+
+        __slots__ = ('t', 'device', 'channel', 'converted_od', 'intensity', 'intensity_blank', 'raw_od')
+
+        def __init__(self, t, device, channel, converted_od, intensity = None, intensity_blank = None, raw_od = None):
+            self.t = t
+            self.device = device
+            self.channel = channel
+            self.converted_od = converted_od
+            self.intensity = intensity
+            self.intensity_blank = intensity_blank
+            self.raw_od = raw_od
+
+    def decode_frame(raw_data):
+        '''Read the readings of a websocket frame.'''
+
+        return [reading(r['t'], r['device'], int(r['channel']), r['converted_od'], r.get('intensity'),
+                        r.get('intensity_blank'), r.get('raw_od')) for r in loads(raw_data)['readings']]
+
+    DECODE_ERRORS = (ValueError, KeyError, TypeError)
+
+def device_key(host, label):
+    '''Name of a device in Bloomie. Devices are prefixed with their host when there are several hosts.'''
+
+    return f'{host}/{label}' if len(mem.hosts) > 1 else label
+
+def connect_to_api(ip_address, username, timeout, progress = print):
+    '''Ask the backend for the list of devices and start the API. Raises an error if the devices don't answer.'''
+
+    import requests
+    import odmeter_api
+
+    device_status = requests.get(f"http://{ip_address}/api/device/", timeout = timeout).json()
+    if not device_status:
+        raise RuntimeError(f'No devices found at {ip_address}.')
+
+    # Start the API
+    progress(f'Starting the API on {ip_address}.')
+    api = odmeter_api.ODMeterSystem(user = username, server_addr = ip_address, timeout = mem.config['api_timeout'],
+                                    retries = mem.config['api_retries'], backoff = mem.config['api_backoff'])
+
+    return device_status, api
+
+def connect_to_hosts(hosts, username, timeout, progress = print):
+    '''Connect to several hosts at the same time. Returns a dict of (device_status, api) for each host.'''
+
+    with ThreadPoolExecutor(max_workers = len(hosts)) as executor:
+        connections = executor.map(lambda host: connect_to_api(host, username, timeout, progress), hosts)
+        return dict(zip(hosts, connections))
+
+def close_hosts():
+    '''Stop the experiments, remove the samples and close the API of every host. A host that can't be reached is
+    skipped with a warning, so that the others are still cleaned up.'''
+
+    for host, api in mem.apis.items():
+        try:
+            if host in mem.experiments:
+                mem.experiments[host].close()
+            api.remove_sample(api.samples())
+
+        except Exception:
+            print(f'\nWarning: could not stop the experiment on {host}:')
+            traceback.print_exc()
+
+        finally:
+            api.close()
+
+def set_devices(connections):
+    '''Fill in the APIs, devices and channels in <mem> from the result of connect_to_hosts.'''
+
+    mem.apis = {}
+    mem.devices = []
+    mem.device_hosts = {}
+
+    for host, (device_status, api) in connections.items():
+        mem.apis[host] = api
+
+        for device in device_status:
+            key = device_key(host, device['label'])
+            mem.devices.append(key)
+            mem.device_hosts[key] = (host, device['label'])
+
+    first_status = next(iter(connections.values()))[0]
+    mem.channels = list(range(len(first_status[0]['channels'])))
+
+class host_reader(threading.Thread):
+    '''Listen to the websocket of one host, and put its readings in a queue shared by all hosts, as (host, readings)
+    tuples. Each host has its own thread, so a slow host does not hold up the others.
+    If the connection drops, reconnect with an exponential backoff (from <reconnect_delay> up to <max_reconnect_delay>
+    seconds), then fetch the readings missed in the meantime from the API.'''
+
+    def __init__(self, host, readings_queue, timeout = 1, reconnect_delay = 1, max_reconnect_delay = 60):
+
+        super().__init__(daemon = True)
+
+        self.host = host
+        self.url = f'ws://{host}/api/ws/'
+        self.readings_queue = readings_queue
+        self.timeout = timeout # s, how often to check whether the recording stopped
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.stopped = threading.Event()
+
+        # Translate the devices' labels into Bloomie's names
+        self.keys = {label: key for key, (host, label) in mem.device_hosts.items() if host == self.host}
+
+        self.ws = None
+
+    def connect(self):
+
+        import websocket
+
+        print(f'Connecting to websocket at {self.url}.')
+        self.ws = websocket.WebSocket()
+        self.ws.connect(self.url, timeout = self.timeout)
+        print(f'Connected to websocket at {self.url}.')
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+
+        import websocket
+
+        while not self.stopped.is_set():
+
+            try:
+                raw_data = self.ws.recv()
+
+            except websocket.WebSocketTimeoutException:
+                continue
+
+            except Exception:
+                if self.stopped.is_set():
+                    break
+
+                print(f'\nWarning: lost the connection to {self.host}:')
+                diagnostics.count(f'reconnections {self.host}')
+                traceback.print_exc()
+                self.reconnect()
+                continue
+
+            start = time.perf_counter()
+            try:
+                readings = decode_frame(raw_data)
+            except DECODE_ERRORS:
+                print(f'\nWarning: could not read the data sent by {self.host}: {raw_data[:100]!r}')
+                continue
+
+            for measurement in readings:
+                measurement.device = self.keys.get(measurement.device, measurement.device)
+
+            diagnostics.record('decode', time.perf_counter() - start)
+            diagnostics.count(f'frames {self.host}')
+
+            if readings:
+                self.readings_queue.put((self.host, readings))
+
+        self.ws.close()
+
+    def reconnect(self):
+        '''Try to connect again until it works or the recording stops, then fetch the missed readings.'''
+
+        self.ws.close()
+        delay = self.reconnect_delay
+
+        while not self.stopped.wait(delay):
+            try:
+                self.connect()
+            except Exception as error:
+                delay = min(2 * delay, self.max_reconnect_delay)
+                print(f'Could not reconnect to {self.host} ({error}), trying again in {delay}s.')
+                continue
+
+            self.backfill()
+            return
+
+    def backfill(self):
+        '''Fetch the readings more recent than the last one received for each culture of the host. The recorder drops
+        any reading that it already has.'''
+
+        readings = []
+
+        try:
+            for sample in mem.apis[self.host].samples():
+
+                device = self.keys.get(sample.device)
+                channel = sample.channel - 1 # one-indexed in backend, zero-indexed in frontend
+                culture = mem.cultures[device][channel] if device in mem.cultures else None
+                if not culture:
+                    continue
+
+                for r in sample.readings():
+                    if parse_time(r['t']) > culture.last_time:
+                        readings.append(reading(r['t'], device, sample.channel, r['converted_od'], r.get('intensity'),
+                                                r.get('intensity_blank'), r.get('raw_od')))
+
+        except Exception:
+            print(f'\nWarning: could not fetch the readings missed while disconnected from {self.host}:')
+            traceback.print_exc()
+
+        if readings:
+            print(f'Recovered {len(readings)} readings from {self.host}.')
+            readings.sort(key = lambda measurement: measurement.t)
+            self.readings_queue.put((self.host, readings))
@@ -0,0 +1,248 @@
+#!/bin/env python3
+'''Level-of-detail decimation of the time series, to plot long experiments with a fixed number of points.'''
+
+import numpy as np
+
+class level:
+    '''Points of a series, in arrays that grow geometrically. The oldest points can be dropped to bound memory: <size>
+    counts all the points ever added, <offset> the ones dropped.
+    The buffers, the offset and the size are published together as a single tuple (see snapshot). New points are
+    written past the published size before a new tuple is published, and the buffers are never modified below it, so
+    another thread can read a snapshot while points are added.'''
+
+    __slots__ = ('data',)
+
+    def __init__(self, capacity = 256):
+        self.data = (np.empty(capacity), np.empty(capacity), 0, 0) # times, values, offset, size
+
+    @property
+    def offset(self):
+        return self.data[2]
+
+    @property
+    def size(self):
+        return self.data[3]
+
+    def snapshot(self, size = None):
+        '''Times and values of the points in memory, up to the point number <size> (all of them by default), and the
+        offset, read consistently.'''
+
+        times, values, offset, level_size = self.data
+        n = max((level_size if size is None else min(size, level_size)) - offset, 0)
+
+        return times[:n], values[:n], offset
+
+    @property
+    def times(self):
+        return self.snapshot()[0]
+
+    @property
+    def values(self):
+        return self.snapshot()[1]
+
+    def append(self, time, value):
+
+        times, values, offset, size = self.data
+        n = size - offset
+
+        if n == len(times):
+            times = np.resize(times, 2 * n)
+            values = np.resize(values, 2 * n)
+
+        times[n] = time
+        values[n] = value
+        self.data = (times, values, offset, size + 1)
+
+    def extend(self, new_times, new_values):
+
+        times, values, offset, size = self.data
+        n = size - offset
+        new_n = n + len(new_times)
+
+        if new_n > len(times):
+            capacity = max(new_n, 2 * len(times))
+            times = np.resize(times, capacity)
+            values = np.resize(values, capacity)
+
+        times[n:new_n] = new_times
+        values[n:new_n] = new_values
+        self.data = (times, values, offset, size + len(new_times))
+
+    def drop(self, n):
+        '''Forget the <n> oldest points, copying the others to new buffers.'''
+
+        times, values, offset, size = self.data
+        kept = size - offset - n
+        capacity = max(2 * kept, 256)
+
+        new_times = np.empty(capacity)
+        new_values = np.empty(capacity)
+        new_times[:kept] = times[n:n + kept]
+        new_values[:kept] = values[n:n + kept]
+
+        self.data = (new_times, new_values, offset + n, size)
+
+def bucket_extrema(times, values, width):
+    '''Minimum and maximum points, in time order, of each complete bucket of <width> consecutive points.'''
+
+    n_buckets = len(times) // width
+    end = n_buckets * width
+    bucket_times = times[:end].reshape(n_buckets, width)
+    bucket_values = values[:end].reshape(n_buckets, width)
+
+    i_min = bucket_values.argmin(axis = 1)
+    i_max = bucket_values.argmax(axis = 1)
+    rows = np.arange(n_buckets)[:, None]
+    columns = np.sort(np.column_stack((i_min, i_max)), axis = 1)
+
+    return bucket_times[rows, columns].ravel(), bucket_values[rows, columns].ravel()
+
+def decimate(times, values, budget):
+    '''Min/max decimation of a whole series into about <budget> points.'''
+
+    width = -(-len(times) // max(budget // 2, 1)) # points per bucket, rounded up
+    if width <= 2:
+        return times, values
+
+    end = len(times) // width * width
+    bucket_times, bucket_values = bucket_extrema(times, values, width)
+
+    # The last, incomplete bucket is kept as is
+    return np.concatenate((bucket_times, times[end:])), np.concatenate((bucket_values, values[end:]))
+
+class decimation_pyramid:
+    '''Min/max decimation of a time series at increasingly coarse levels.
+    Level 0 is the raw series. Each bucket of level 1 summarises <factor> raw points, and each bucket of level k
+    summarises <factor> buckets of level k - 1. A bucket is stored as its minimum and maximum points, in time order,
+    so that spikes survive decimation. Buckets are only computed once they are complete.
+    With <retention>, each level only keeps about its <retention> most recent points in memory (between 1 and 2 times
+    as many); older times are covered by the coarser levels.'''
+
+    __slots__ = ('factor', 'retention', 'levels', 'consumed')
+
+    def __init__(self, factor = 4, retention = None):
+        self.factor = factor
+        self.retention = retention
+        self.levels = [] # levels 1, 2, ...
+        self.consumed = [] # number of points of the level below already summarised in each level
+
+    def update(self, raw):
+        '''Summarise the new complete buckets of the raw series (a level).'''
+
+        source = raw
+
+        k = 0
+        while k <= len(self.levels):
+
+            width = self.factor if k == 0 else 2 * self.factor # number of source points per bucket
+
+            # Add a level on top once there is enough data to fill a bucket of it
+            if k == len(self.levels):
+                if source.size < 2 * width:
+                    break
+                self.levels.append(level())
+                self.consumed.append(0)
+
+            start = self.consumed[k] - source.offset
+            source_times, source_values = source.times, source.values
+
+            if len(source_times) - start >= width:
+                bucket_times, bucket_values = bucket_extrema(source_times[start:], source_values[start:], width)
+                self.levels[k].extend(bucket_times, bucket_values)
+                self.consumed[k] += len(bucket_times) // 2 * width
+
+            source = self.levels[k]
+            k += 1
+
+        # Forget the oldest points of each level once the level above summarised them. The top level stays complete.
+        if self.retention:
+            for k in range(len(self.levels) - 1):
+                in_memory = self.levels[k].size - self.levels[k].offset
+                if in_memory > 2 * self.retention:
+                    self.levels[k].drop(min(in_memory - self.retention, self.consumed[k + 1] - self.levels[k].offset))
+
+    def render(self, times, values, budget, t_start = None, t_end = None, history = None):
+        '''Return the points to draw between <t_start> and <t_end> (the whole series by default), using the finest
+        level that fits in <budget> points. <times> and <values> are the raw series in memory, and <history> the
+        (times, values) of the older raw points, if they were moved out of memory.'''
+
+        if history is None:
+            history = (times[:0], values[:0])
+
+        history_times, history_values = history
+
+        if t_start is None:
+            t_start = -np.inf
+        if t_end is None:
+            t_end = np.inf
+
+        # Snapshot each level once, keeping only the buckets complete within the raw points given, since the recorder
+        # may add points in the meantime
+        n_raw = len(history_times) + len(times)
+        series = [(times, values, len(history_times))] + \
+                 [lvl.snapshot(2 * (n_raw // self.factor ** k)) for k, lvl in enumerate(list(self.levels), 1)]
+        n_levels = len(series) - 1
+
+        def count(level_times):
+            return np.searchsorted(level_times, t_end, 'right') - np.searchsorted(level_times, t_start)
+
+        def covers(k):
+            level_times, level_values, offset = series[k]
+            return not offset or (len(level_times) and level_times[0] <= t_start)
+
+        def history_range():
+            '''Raw points of the range (with one more on each side), reading the older ones back from disk.'''
+
+            first = max(np.searchsorted(history_times, t_start) - 1, 0)
+            last = np.searchsorted(history_times, t_end, 'right') + 1
+            memory_first = max(np.searchsorted(times, t_start) - 1, 0)
+            memory_last = np.searchsorted(times, t_end, 'right') + 1
+
+            return (np.concatenate((history_times[first:last], times[memory_first:memory_last])),
+                    np.concatenate((history_values[first:last], values[memory_first:memory_last])))
+
+        n_visible = count(history_times) + count(times)
+
+        # Zoomed in on data moved out of memory: draw the raw points
+        if n_visible <= budget and not covers(0):
+            return history_range()
+
+        # Finest level with few enough points in the visible range: level k has 2 points per <factor>**k raw points.
+        # They are counted from the raw points, since the finer levels may not go back to the start of the range.
+        k = 0
+        while k < n_levels and (2 * n_visible / self.factor ** k if k else n_visible) > budget:
+            k += 1
+
+        # That level no longer goes back to the start of the range: decimate the raw points from disk if there are not
+        # too many, otherwise use a coarser level
+        if not covers(k):
+            if n_visible <= budget * self.factor ** 2:
+                return decimate(*history_range(), budget)
+
+            while not covers(k):
+                k += 1
+
+        # Level k only covers complete buckets: finish the curve with finer levels
+        parts_times = []
+        parts_values = []
+        covered = 0 # raw points covered by the coarser levels
+
+        for j in range(k, -1, -1):
+            level_times, level_values, offset = series[j]
+            points_per_bucket = 2 if j else 1
+            raw_per_bucket = self.factor ** j
+
+            start = max((covered // raw_per_bucket) * points_per_bucket - offset, 0)
+            parts_times.append(level_times[start:])
+            parts_values.append(level_values[start:])
+
+            covered = ((offset + len(level_times)) // points_per_bucket) * raw_per_bucket
+
+        plot_times = np.concatenate(parts_times)
+        plot_values = np.concatenate(parts_values)
+
+        # Crop to the visible range, keeping one point on each side so that the line reaches the edges
+        first = max(np.searchsorted(plot_times, t_start) - 1, 0)
+        last = np.searchsorted(plot_times, t_end, 'right') + 1
+
+        return plot_times[first:last], plot_values[first:last]
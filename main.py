@@ -1,25 +1,27 @@
 #D3D3D3!/bin/env python3
 import sys, os
 import math
-import requests
+import time
 
 from datetime import datetime
-import iso8601 # parse ISO 8601 dates
-from fnmatch import fnmatch # match strings with wildcards
+import re
+from fnmatch import translate # convert wildcards to regular expressions
 
 from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QLineEdit
-from PyQt5.QtWidgets import QTabWidget, QTableWidgetItem, QSizePolicy, QFormLayout, QLabel, QMessageBox
+from PyQt5.QtWidgets import QTabWidget, QTableWidgetItem, QSizePolicy, QFormLayout, QLabel, QMessageBox, QGridLayout
+from PyQt5.QtWidgets import QPlainTextEdit
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer, QEvent
 from PyQt5 import QtGui
 import pyqtgraph as pg
 
-import websocket
-
 from copy_paste_table_widget import CopyPasteTableWidget # variant of QTableWidget that allows for copy-pasting
 import mem
 import data_management
-import odmeter_api
+import record_file
+import ingestion
+import diagnostics
+from workers import run_in_background
 
 class OD_reader_app(QMainWindow):
 
@@ -47,6 +49,7 @@ class OD_reader_app(QMainWindow):
 
         self.ip_field = QLineEdit()
         self.ip_field.setText(mem.config['default_ip_address'])
+        self.ip_field.setToolTip('Address of the readers\' host. Separate several hosts with commas.')
         self.ip_field.returnPressed.connect(self.connect_to_devices)
         exp_details_form.addRow('IP address:', self.ip_field)
 
@@ -107,6 +110,10 @@ class OD_reader_app(QMainWindow):
         # Visualisation control strip
         self.highlight_strip_layout = QHBoxLayout()
 
+        # Highlight fields, wrapped over several rows when there are many colors
+        highlight_grid = QGridLayout()
+        self.highlight_strip_layout.addLayout(highlight_grid)
+
         self.highlight_fields = {}
         for i in range(len(mem.config['highlight_colors'])):
             color = mem.config['highlight_colors'][i]
@@ -114,20 +121,49 @@ class OD_reader_app(QMainWindow):
             highlight_field = QLineEdit()
             highlight_field.setStyleSheet(f"color: {color}")
             highlight_field.setPlaceholderText(f"Highlight keyword {i + 1}")
-            highlight_field.editingFinished.connect(self.draw_plots)
+            highlight_field.editingFinished.connect(self.update_highlights)
 
-            self.highlight_strip_layout.addWidget(highlight_field)
+            highlight_grid.addWidget(highlight_field, i // mem.config['highlight_fields_per_row'],
+                                     i % mem.config['highlight_fields_per_row'])
             self.highlight_fields[color] = highlight_field
 
+        self.highlight_keywords = None # keywords the highlights were computed for
+        self.highlight_pattern = None # all the keywords, compiled into a single expression
+        self.highlights = {} # (device, channel): (color, linewidth) of the highlighted cultures
+
         self.log_scale_button = QPushButton("Log Scale")
         self.log_scale_button.setCheckable(True)
         self.log_scale_button.clicked.connect(self.toggle_log_scale)
         self.highlight_strip_layout.addWidget(self.log_scale_button)
 
+        self.doubling_time_button = QPushButton("Doubling Time")
+        self.doubling_time_button.setCheckable(True)
+        self.doubling_time_button.setToolTip('Plot the doubling time (min) estimated live, instead of the OD.')
+        self.doubling_time_button.clicked.connect(self.request_redraw)
+        self.highlight_strip_layout.addWidget(self.doubling_time_button)
+
         self.freeze_button = QPushButton("Freeze plots")
         self.freeze_button.setCheckable(True)
+        self.freeze_button.clicked.connect(self.request_redraw) # catch up when unfrozen
         self.highlight_strip_layout.addWidget(self.freeze_button)
 
+        self.diagnostics_button = QPushButton("Diagnostics")
+        self.diagnostics_button.setCheckable(True)
+        self.diagnostics_button.setChecked(mem.config['diagnostics_panel'])
+        self.diagnostics_button.clicked.connect(self.toggle_diagnostics)
+        self.highlight_strip_layout.addWidget(self.diagnostics_button)
+
+        # Timings of the recording pipeline, to see which stage falls behind
+        self.diagnostics_panel = QPlainTextEdit()
+        self.diagnostics_panel.setReadOnly(True)
+        self.diagnostics_panel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.diagnostics_panel.setMaximumHeight(150)
+        self.diagnostics_panel.setVisible(mem.config['diagnostics_panel'])
+
+        self.diagnostics_timer = QTimer()
+        self.diagnostics_timer.timeout.connect(self.update_diagnostics)
+        self.diagnostics_timer.start(int(1000 * mem.config['diagnostics_interval']))
+
         # Plot area using PyQtGraph
         self.plot_widget = pg.PlotWidget()
         self.plot_widget.setBackground('w')
@@ -141,6 +177,10 @@ class OD_reader_app(QMainWindow):
         
         pg.setConfigOptions(antialias = mem.config['antialiasing'])
 
+        # Load finer details when zooming in
+        self.auto_ranging = False
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self.zoom_plots)
+
         # Strip of buttons for recording data
         self.record_strip_layout = QHBoxLayout()
 
@@ -180,34 +220,36 @@ class OD_reader_app(QMainWindow):
         self.max_points_field.setFixedWidth(50)
         self.max_points_field.setText(str(mem.config['max_points']))
         self.max_points_field.setValidator(QtGui.QIntValidator(1, mem.config['max_points']))
-        self.max_points_field.setToolTip('Plot the last N points.')
-        self.max_points_field.editingFinished.connect(self.draw_plots)
+        self.max_points_field.setToolTip('Maximum number of points per curve (older data is shown at a lower resolution).')
+        self.max_points_field.editingFinished.connect(self.request_redraw)
         self.record_strip_layout.addWidget(self.max_points_field)
 
-        self.record_strip_layout.addWidget(QLabel("Downsample:"))
-
-        self.downsample_field = QLineEdit()
-        self.downsample_field.setFixedWidth(50)
-        self.downsample_field.setText('1')
-        self.downsample_field.setToolTip('Only plot every Nth point (all data is still recorded).')
-        self.downsample_field.setValidator(QtGui.QIntValidator(1, mem.config['max_points']))
-        self.downsample_field.editingFinished.connect(self.draw_plots)
-        self.record_strip_layout.addWidget(self.downsample_field)
-
         # Build the tab layout
         recording_tab_layout.addLayout(self.record_strip_layout)
         recording_tab_layout.addWidget(self.plot_widget)
         recording_tab_layout.addLayout(self.highlight_strip_layout)
-
-        recording_tab_widget = QWidget()
-        recording_tab_widget.setLayout(recording_tab_layout)
-        self.tabs.addTab(recording_tab_widget, "Measurement")
+        recording_tab_layout.addWidget(self.diagnostics_panel)
+
+        self.measurement_tab = QWidget()
+        self.measurement_tab.setLayout(recording_tab_layout)
+        self.tabs.addTab(self.measurement_tab, "Measurement")
+
+        # Whatever asks for the plots to be redrawn (new data, display settings), they are drawn at most once per
+        # frame interval, and not at all while they cannot be seen
+        self.redraw_timer = QTimer()
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.timeout.connect(self.scheduled_redraw)
+        self.last_redraw = 0 # time.monotonic() of the last frame
+        self.redraw_pending = False # a frame was skipped while the plots were not visible
+        self.redraw_all = False # the next frame redraws the whole plots
+        self.zoom_range = None # or only renders the curves again for this range of times
+        self.tabs.currentChanged.connect(self.resume_redraws)
 
         # Initially disable the tab
         self.tabs.setTabEnabled(1, False)
 
-        # Set websocket to receive data
-        self.ws = websocket.WebSocket()
+        # Curves and labels of each culture, created when the recording starts
+        self.plot_items = {}
 
         # Try to connect to the default IP address (can be disabled in config)
         if mem.config['auto_connect']:
@@ -216,41 +258,44 @@ class OD_reader_app(QMainWindow):
     def connect_to_devices(self):
         '''Connect to the devices at the IP address entered, and determine the number of devices/channels.'''
 
-        mem.ip_address = self.ip_field.text()
+        # Several hosts can be separated by commas or spaces
+        mem.hosts = list(dict.fromkeys(self.ip_field.text().replace(',', ' ').split()))
         mem.experiment_name = self.exp_details['experiment_name'].text()
         self.filename_field.setText(mem.experiment_name + '.tsv') # update the filename field to match experiment name
+
+        if not mem.hosts:
+            return
         
-        # Try to connect to the devices
-        self.exp_details_note.setText(f'Connecting to {mem.ip_address}.')
+        # Try to connect to the devices, without blocking the window
+        self.exp_details_note.setText(f'Connecting to {", ".join(mem.hosts)}.')
+        self.exp_details_connect_button.setEnabled(False)
 
-        try:
-            device_status = requests.get(f"http://{mem.ip_address}/api/device/", timeout = mem.config['connection_timeout']).json()
-        except:
-            device_status = []
+        username = self.exp_details['username'].text()
+        run_in_background(ingestion.connect_to_hosts, mem.hosts, username, mem.config['connection_timeout'],
+                          on_finished = self.devices_connected, on_failed = self.connection_failed,
+                          on_progress = self.exp_details_note.setText)
 
-        if device_status: # successfully connected to the devices
-            self.exp_details_note.setText(f'Connected to {mem.ip_address}.')
+    def devices_connected(self, connections):
+        '''Set up the reactors table once the devices answered.'''
 
-            # Enable the recording tab
-            self.tabs.setTabEnabled(1, True)
+        self.exp_details_connect_button.setEnabled(True)
+        self.exp_details_note.setText(f'Connected to {", ".join(mem.hosts)}.')
 
-            # Set the devices and channels
-            mem.ws_url = f"ws://{mem.ip_address}/api/ws/"
-            mem.devices = [device['label'] for device in device_status]
-            mem.channels = list(range(len(device_status[0]['channels'])))
+        # Enable the recording tab
+        self.tabs.setTabEnabled(1, True)
 
-            # Setup the reactors table
-            self.setup_reactors_table()
+        # Set the devices and channels
+        ingestion.set_devices(connections)
 
-            # Start the API
-            print(f'Starting the API...')
-            username = self.exp_details['username'].text()
-            mem.api = odmeter_api.ODMeterSystem(user = username, server_addr = mem.ip_address)
+        # Setup the reactors table
+        self.setup_reactors_table()
 
+    def connection_failed(self, message):
 
-        else: # failed to connect
-            self.exp_details_note.setText(f'Failed to connect to the devices at {mem.ip_address}.')
-            self.tabs.setTabEnabled(1, False)
+        self.exp_details_connect_button.setEnabled(True)
+        self.exp_details_note.setText(f'Failed to connect to the devices at {", ".join(mem.hosts)}.')
+        self.exp_details_note.setToolTip(message)
+        self.tabs.setTabEnabled(1, False)
 
     def setup_reactors_table(self):
 
@@ -282,13 +327,6 @@ class OD_reader_app(QMainWindow):
         filename = os.path.expanduser(self.filename_field.text())
         mem.file_path = os.path.join(folder, filename)
 
-        def make_headers():
-            '''Create a new file with tab-separated headers.'''
-
-            with open(mem.file_path, 'w') as file:
-                print(f'Creating data file {mem.file_path}.')
-                file.write("time\tdevice\tchannel\tname\tintensity\tintensity_blank\traw_od\tconverted_od\tannotation\n")
-
         if os.path.exists(mem.file_path): # The file already exists
 
             # Ask the user if they want to overwrite the file, append to it or cancel
@@ -305,11 +343,12 @@ class OD_reader_app(QMainWindow):
             user_response = msg_box.exec()
 
             if user_response == QMessageBox.Yes:
-                make_headers()
+                record_file.create_record(mem.file_path)
                 return True
 
             elif user_response == QMessageBox.No:
                 print(f'New data will be appended to {mem.file_path}.')
+                mem.recorder.resume = True # plot the data already in the file
                 return True
 
             else: # User canceled
@@ -317,7 +356,7 @@ class OD_reader_app(QMainWindow):
                 return False
                 
         else: # The file doesn't exist, create one with appropriate headers
-            make_headers()
+            record_file.create_record(mem.file_path)
             return True
 
     def start_recording_loop(self):
@@ -335,109 +374,285 @@ class OD_reader_app(QMainWindow):
 
             # Update the reactors' labels
             mem.recorder.initialize_cultures()
+            self.initialize_plots()
 
-            # Start the backend
-            mem.recorder.start_backend()
+            # Start the backend in the background, then start recording (unless the window is closed in the meantime)
+            mem.running = True
+            self.record_button.setEnabled(False)
 
-            # Connect data reception to plotting
-            mem.recorder.data_updated.connect(self.draw_plots)
+            standard_curve = self.exp_details['standard_curve'].text()
+            recording_interval = int(self.exp_details['interval'].text())
+            mem.experiment_name = self.exp_details['experiment_name'].text()
 
-            # Start recording data
-            mem.recorder.start()
+            run_in_background(mem.recorder.start_backend, standard_curve, recording_interval, mem.experiment_name,
+                              on_finished = self.backend_started, on_failed = self.backend_failed,
+                              on_progress = self.statusBar().showMessage)
 
-    def draw_line(self, culture, color, linewidth):
-        '''Draw the curve for one culture.'''
-        
-        # Prepare the data to plot
-        downsampling = int(self.downsample_field.text()) if self.downsample_field.text() else int()
-        if not downsampling or downsampling < 1:
-            downsampling = 1
-            self.downsample_field.setText('1')
+    def backend_started(self, result):
+        '''Start receiving data once the backend is recording.'''
+
+        self.record_button.setEnabled(True)
+        self.statusBar().showMessage('Recording.')
+
+        # Connect data reception to plotting
+        mem.recorder.data_updated.connect(self.request_redraw)
+        mem.recorder.recording_failed.connect(self.recording_failed)
+
+        # Start recording data
+        mem.recorder.start()
+
+    def backend_failed(self, message):
+
+        self.record_button.setEnabled(True)
+        self.record_button.setChecked(False)
+        self.statusBar().showMessage(f'Failed to start the experiment: {message}')
+
+    def recording_failed(self, message):
+
+        self.record_button.setChecked(False)
+        self.statusBar().showMessage(f'Recording stopped: {message}')
+
+    def initialize_plots(self):
+        '''Create one curve and one label per culture. They are then updated in place by draw_plots.'''
+
+        self.plot_widget.clear()
+        self.plot_items = {}
+
+        font = pg.QtGui.QFont()
+        font.setPointSize(12)
+        font.setBold(True)
+
+        for device in mem.active_devices:
+            for channel in mem.channels:
+
+                culture = mem.cultures[device][channel]
+
+                if culture:
+                    curve = self.plot_widget.plot([], [], name = culture.name)
+
+                    label = pg.TextItem()
+                    label.setAnchor((0, 0.5))
+                    label.setFont(font)
+                    label.setVisible(False)
+                    self.plot_widget.addItem(label)
+
+                    # style: (color, linewidth) currently applied, drawn: state of the data currently displayed,
+                    # size: number of points of the culture included in the plot
+                    self.plot_items[(device, channel)] = {'curve': curve, 'label': label, 'style': None, 'drawn': None,
+                                                          'size': 0}
+
+        # The names of the cultures may have changed
+        self.update_highlights(force = True)
+
+    def point_budget(self):
+        '''Number of points to draw per curve: two per pixel (minimum and maximum), up to the Points field.'''
 
         max_points = int(self.max_points_field.text()) if self.max_points_field.text() else int()
         if not max_points or max_points < 1:
             max_points = 1
             self.max_points_field.setText('1')
 
-        # Domnsample starting from the end, then keep only the <max_points> most recent points
-        times_str = culture.times[::-downsampling][:max_points]
-        ods = culture.ods[::-downsampling][:max_points]
-        
-        times = [iso8601.parse_date(t).timestamp() for t in times_str]
+        width = int(self.plot_widget.getViewBox().width())
 
-        # Plot the data
-        pen = pg.mkPen(color = color, width = linewidth)
-        self.plot_widget.plot(times, ods, pen = pen, name = culture.name)
+        return min(max_points, 2 * width) if width > 0 else max_points
 
-        # Add the name of the culture at the end of the curve
-        if not self.log_scale_button.isChecked() or ods[-1] > 0: # avoid log of negative numbers
+    def draw_line(self, key, culture, color, linewidth, budget):
+        '''Update the curve and label of one culture, only touching what changed since the last draw.'''
 
-            text = pg.TextItem(html=f'<div style="text-align: center"><span style="color: {color}">{culture.name}</span></div>')
-            text.setAnchor((0, 0.5))
-            font = pg.QtGui.QFont()
-            font.setPointSize(12)
-            font.setBold(True)
-            text.setFont(font)
+        items = self.plot_items[key]
+        curve, label = items['curve'], items['label']
 
-            try:
-                # Last point is element 0 because the list is reversed
-                if self.log_scale_button.isChecked():
-                    text.setPos(times[0], math.log10(ods[0]))
-                else:
-                    text.setPos(times[0], ods[0])
+        # Restyle the existing items if the highlight changed
+        if items['style'] != (color, linewidth):
+            items['style'] = (color, linewidth)
+            curve.setPen(pg.mkPen(color = color, width = linewidth))
+            curve.setZValue(linewidth) # highlighted curves on top
+            label.setHtml(f'<div style="text-align: center"><span style="color: {color}">{culture.name}</span></div>')
+
+        # Skip the curve if neither its data nor the display settings changed
+        doubling_time = self.doubling_time_button.isChecked()
+        size = culture.growth_rates.size if doubling_time else culture.size # the recorder may add points in the meantime
+        log_scale = self.log_scale_button.isChecked()
+        state = (size, budget, log_scale, doubling_time)
+        if items['drawn'] == state:
+            return
+        items['drawn'] = state
+        items['size'] = size
+
+        if not size: # Do not plot cultures without data
+            curve.setData([], [])
+            label.setVisible(False)
+            return
+
+        # Whole experiment, at the finest level of detail that fits in the budget
+        curve.setData(*culture.render(budget, size = size, doubling_time = doubling_time))
 
-            except:
-                print('Error setting label position:')
-                print(times)
-                print(ods)
+        # Move the name of the culture to the end of the curve
+        last_time, last_value = culture.last(size, doubling_time)
+        if not log_scale or last_value > 0: # avoid log of negative numbers (NaN fails both tests)
 
-            self.plot_widget.addItem(text)
+            if log_scale:
+                label.setPos(last_time, math.log10(last_value))
+            else:
+                label.setPos(last_time, last_value)
+
+            label.setVisible(True)
+
+        else:
+            label.setVisible(False)
 
     def draw_plots(self):
         '''Draw plots of the data in <mem>. The cultures that match the regexes in the text fields will be highlighted
         in colors, while the rest is gray.'''
 
-        if not mem.cultures:
+        if not mem.cultures or not self.plot_items:
             return
 
         # Pause plotting when the button is checked
         if self.freeze_button.isChecked():
             return
 
-        self.plot_widget.clear()
- 
-        # Get highlight keywords from the text fields
-        highlight_colors = {self.highlight_fields[color].text(): color for color in mem.config['highlight_colors'] \
-                            if self.highlight_fields[color].text()}
-        highlighted_cultures = {color:[] for color in mem.config['highlight_colors']}
+        start = time.perf_counter()
+
+        # Time between the recorder signalling new data and the plots being drawn
+        if mem.recorder is not None and mem.recorder.updated_at is not None:
+            diagnostics.record('plot_delay', start - mem.recorder.updated_at)
+            mem.recorder.updated_at = None
+
+        budget = self.point_budget()
+
+        normal_style = (mem.config['normal_color'], mem.config['normal_line_width'])
 
-        # Plot the cultures that are not highlighted in gray
         for device in mem.active_devices:
             for channel in mem.channels:
 
                 if mem.cultures[device][channel]:
+                    color, linewidth = self.highlights.get((device, channel), normal_style)
+                    self.draw_line((device, channel), mem.cultures[device][channel], color, linewidth, budget)
 
-                    culture = mem.cultures[device][channel]
-                    highlighted = False
+        # Ensure the labels fit in the field of view
+        self.auto_ranging = True
+        self.plot_widget.getViewBox().autoRange(padding = mem.config['padding'])
+        self.auto_ranging = False
 
-                    for keyword, color in highlight_colors.items():
-                        
-                        # Check if the keyword is in the name, allowing '*' for a wild-card
-                        if fnmatch(culture.name.lower(), f'*{keyword}*'.lower()) and not highlighted:
-                            highlighted_cultures[color].append(culture)
-                            highlighted = True
+        diagnostics.record('draw_plots', time.perf_counter() - start)
+        diagnostics.count('redraws')
 
-                    if not highlighted:
-                        self.draw_line(culture, mem.config['normal_color'], mem.config['normal_line_width'])
+    def request_redraw(self, *signal_args, zoom_range = None):
+        '''Redraw the plots at the next frame. Requests arriving before it are merged into it. With <zoom_range>, only
+        the curves are rendered again for that range of times, unless the whole plots are redrawn in the same frame.
+        The arguments of the signals connected to it (e.g. checked) are ignored.'''
 
-        # Plot the highlighted cultures
-        for color, cultures in highlighted_cultures.items():
-            for culture in cultures:
-                if culture.times: # Do not plot cultures without data
-                    self.draw_line(culture, color, mem.config['highlight_line_width'])
+        if zoom_range is None:
+            self.redraw_all = True
+        else:
+            self.zoom_range = zoom_range
 
-        # Ensure the labels fit in the field of view
-        self.plot_widget.getViewBox().autoRange(padding = mem.config['padding'])
+        diagnostics.count('redraw_requests')
+
+        if self.redraw_timer.isActive():
+            diagnostics.count('redraws_coalesced')
+            return
+
+        delay = self.last_redraw + mem.config['frame_interval'] - time.monotonic()
+        self.redraw_timer.start(max(0, int(1000 * delay)))
+
+    def plots_visible(self):
+        return self.isVisible() and not self.isMinimized() and self.tabs.currentWidget() is self.measurement_tab
+
+    def scheduled_redraw(self):
+        '''Draw a frame, unless the plots cannot be seen: then it is drawn when they are shown again.'''
+
+        self.last_redraw = time.monotonic()
+
+        if not self.plots_visible():
+            self.redraw_pending = True
+            diagnostics.count('redraws_skipped')
+
+            # The time spent hidden is not a plotting delay
+            if mem.recorder is not None:
+                mem.recorder.updated_at = None
+            return
+
+        self.redraw_pending = False
+
+        redraw_all, zoom_range = self.redraw_all, self.zoom_range
+        self.redraw_all, self.zoom_range = False, None
+
+        if redraw_all:
+            self.draw_plots()
+
+        # Redrawing the whole plots resets the view, unless they are frozen
+        if zoom_range is not None and (not redraw_all or self.freeze_button.isChecked()):
+            self.draw_range(*zoom_range)
+
+    def resume_redraws(self):
+        '''Draw the frame skipped while the plots were not visible, if they are visible again.'''
+
+        if self.redraw_pending and self.plots_visible():
+            self.request_redraw()
+
+    def changeEvent(self, a0):
+        '''Catch up with the plots when the window is restored.'''
+
+        super().changeEvent(a0)
+        if a0.type() == QEvent.WindowStateChange:
+            self.resume_redraws()
+
+    def update_highlights(self, force = False):
+        '''Find which cultures match the keywords of the highlight fields, then redraw the plots. This is only done
+        when the keywords changed (or with <force>, when the cultures changed), not at every update of the data.'''
+
+        keywords = tuple((self.highlight_fields[color].text(), color) for color in mem.config['highlight_colors'])
+
+        if keywords != self.highlight_keywords or force:
+            self.highlight_keywords = keywords
+
+            # Combine the keywords in a single case-insensitive expression: the first field that matches wins.
+            # '*' is a wild-card, and keywords can match anywhere in the name.
+            groups = [(f'h{i}', color, translate(f'*{keyword}*')) for i, (keyword, color) in enumerate(keywords) if keyword]
+            self.highlight_pattern = re.compile('|'.join(f'(?P<{group}>{pattern})' for group, color, pattern in groups),
+                                                re.IGNORECASE) if groups else None
+            group_colors = {group: color for group, color, pattern in groups}
+
+            # Style of each culture
+            self.highlights = {}
+            if self.highlight_pattern:
+                for device in mem.active_devices:
+                    for channel in mem.channels:
+                        culture = mem.cultures[device][channel] if device in mem.cultures else None
+                        match = self.highlight_pattern.fullmatch(culture.name) if culture else None
+                        if match:
+                            self.highlights[(device, channel)] = (group_colors[match.lastgroup],
+                                                                  mem.config['highlight_line_width'])
+
+        self.request_redraw()
+
+    def zoom_plots(self, viewbox, x_range):
+        '''Redraw the curves with a finer level of detail for the visible range, at the next frame.'''
+
+        if self.auto_ranging or not self.plot_items:
+            return
+
+        self.request_redraw(zoom_range = tuple(x_range))
+
+    def draw_range(self, t_start, t_end):
+        '''Render the curves again between <t_start> and <t_end>. Only the points that were already plotted are used, so
+        that frozen plots stay frozen.'''
+
+        if not self.plot_items:
+            return
+
+        budget = self.point_budget()
+        doubling_time = self.doubling_time_button.isChecked()
+
+        for (device, channel), items in self.plot_items.items():
+
+            size = items['size']
+            if size:
+                items['curve'].setData(*mem.cultures[device][channel].render(budget, t_start, t_end, size, doubling_time))
+
+                items['drawn'] = None # the next update goes back to the whole experiment
 
     def toggle_log_scale(self):
         '''Switch log scale and redraw the plots.'''
@@ -447,7 +662,29 @@ class OD_reader_app(QMainWindow):
         else:
             self.plot_widget.setLogMode(y=False)
 
-        self.draw_plots()
+        self.request_redraw()
+
+    def toggle_diagnostics(self):
+
+        self.diagnostics_panel.setVisible(self.diagnostics_button.isChecked())
+        self.update_diagnostics()
+
+    def update_diagnostics(self):
+        '''Show the latest timings in the panel, and write them to the diagnostics file if there is one.'''
+
+        if not self.diagnostics_button.isChecked() and not mem.config['diagnostics_file']:
+            return
+
+        snapshot = diagnostics.snapshot()
+
+        if self.diagnostics_button.isChecked():
+            self.diagnostics_panel.setPlainText(diagnostics.format_snapshot(snapshot))
+
+        if mem.config['diagnostics_file']:
+            try:
+                diagnostics.dump(os.path.expanduser(mem.config['diagnostics_file']), snapshot)
+            except OSError as error:
+                print(f'\nWarning: could not write the diagnostics file: {error}')
 
     def closeEvent(self, a0):
         '''Stop the recording loop and close the websocket when the window is closed.'''
@@ -471,14 +708,9 @@ class OD_reader_app(QMainWindow):
         if confirmed:
 
             mem.running = False
+            self.update_diagnostics()
 
-            if mem.ws:
-                if mem.ws.connected:
-                    mem.ws.close()
-
-            if mem.api:
-                mem.api.experiments()[0].close()
-                mem.api.remove_sample(mem.api.samples())
+            ingestion.close_hosts()
             
             a0.accept()  # Allow the window to close
         else:
@@ -3,27 +3,25 @@
 
 import os, yaml
 
-# Load configuration
-CONFIG_PATHS = [os.path.expanduser('~/.config/bloomie.yaml'), 'default_config.yaml']
+# Load configuration: the user's file overrides the default values
+CONFIG_PATHS = ['default_config.yaml', os.path.expanduser('~/.config/bloomie.yaml')]
 
+config = {}
 for path in CONFIG_PATHS:
     if os.path.exists(path):
         with open(path, 'r') as config_file:
-            config = yaml.safe_load(config_file)
+            config.update(yaml.safe_load(config_file) or {})
             print('Loaded config from', path)
-        break
 
 main_window = None
-api = None
 
 # Devices properties
-ip_address = '' # local ip address of the devices
-ws_url = '' # url of websocket
-ws = None # placeholder for websocket object
+hosts = [] # addresses of the reader hosts, e.g. 10.0.0.1:8080
 
-devices = [] # labels of the devices
+devices = [] # names of the devices (prefixed with their host when there are several hosts)
 channels = [] # should be 0 to 7
 device_ids = {} # link a device's name to its zero-indexed id
+device_hosts = {} # link a device's name to its host and its label on the host
 
 # Recording properties
 experiment_name = '' # name of the experiment
@@ -31,7 +29,8 @@ file_path = '' # path to write the data to
 running = False # keeps track of whether recording is running
 active_devices = [] # list of devices that are currently recording
 
-api = None # placeholder for api object
+apis = {} # api object of each host
+experiments = {} # experiment running on the backend of each host
 recorder = None # placeholder for data recorder object
 
 # Cultures properties
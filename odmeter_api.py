@@ -1,12 +1,25 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import typing
-import pandas as pd
+import numpy as np
+# pandas is slow to import: it is imported by the functions that build DataFrames
 import json
 import iso8601
 
 class ODMeterSystem:
-    def __init__(self, user: str, server_addr: str = "127.0.0.1:8080"):
+    def __init__(self, user: str, server_addr: str = "127.0.0.1:8080",
+                 timeout: float = 10, retries: int = 3, backoff: float = 0.5):
         self._server_addr = server_addr
+        self._timeout = timeout
+
+        # Keep the connections to the backend open between requests. Failed connections are retried with an
+        # exponential backoff; reads are only retried for requests that can safely be repeated.
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[502, 503, 504],
+                      allowed_methods=["GET", "DELETE"], raise_on_status=False)
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(max_retries=retry))
+
         self._config = self.config()
 
         user_list = [u["name"] for u in self._config["users"]]
@@ -15,27 +28,34 @@ class ODMeterSystem:
         else:
             raise ValueError("user not found")
 
+    def _request(self, method: str, path: str, **kwargs):
+        kwargs.setdefault("timeout", self._timeout)
+        return self._session.request(method, "http://%s/api/%s" % (self._server_addr, path), **kwargs)
+
+    def close(self):
+        self._session.close()
+
     def config(self):
-        return requests.get("http://%s/api/config/" % self._server_addr).json()
+        return self._request("GET", "config/").json()
 
     def standard_curves(self):
-        config = self.config()
         standard_curves = []
-        for resp in config['standard_curves']:
+        for resp in self._config['standard_curves']:
             standard_curves.append(StandardCurve(resp))
-    
+        return standard_curves
+
     def device_status(self):
-        return requests.get("http://%s/api/device/" % self._server_addr).json()
+        return self._request("GET", "device/").json()
 
     def samples(self):
-        resp_list = requests.get("http://%s/api/sample/" % self._server_addr).json()
+        resp_list = self._request("GET", "sample/").json()
         samples = []
         for resp in resp_list:
             samples.append(Sample(resp["device"], resp["channel"], resp, self))
         return samples
     
     def experiments(self):
-        resp_list = requests.get("http://%s/api/acqusition/" % self._server_addr).json()
+        resp_list = self._request("GET", "acqusition/").json()
         experiments = []
 
         if resp_list: # resp_list is None if there are no experiments
@@ -88,19 +108,36 @@ class ODMeterSystem:
                     req["standard_curve_name"] = ""
                 else:
                     req["standard_curve_name"] = standard_curve_name[i]
+
+                req["user"] = self._user
                 
                 req_list.append(req)
         else:
             raise ValueError("device is expected to be str or list of str")
 
-        resp = requests.post("http://%s/api/sample/" % self._server_addr, json=req_list)
+        resp = self._request("POST", "sample/", json=req_list)
         if resp.status_code != 200:
             raise RuntimeError("%d: %s" % (resp.status_code, resp.text))
+
+        # Return the created samples if the backend sends all of them back, otherwise None (use samples() to list them)
+        try:
+            resp_list = resp.json()
+        except ValueError:
+            return None
+        if not isinstance(resp_list, list) or len(resp_list) != len(req_list):
+            return None
+        for req, resp in zip(req_list, resp_list):
+            if not (isinstance(resp, dict) and "uuid" in resp and str(resp.get("device")) == str(req["device"])
+                    and str(resp.get("channel")) == str(req["channel"])):
+                return None
+        return [Sample(resp["device"], resp["channel"], resp, self) for resp in resp_list]
     
     def remove_sample(self, samples):
         req_list = []
         if not isinstance(samples, list):
             samples = [samples]
+        if not samples:
+            return
         
         for sample in samples:
             req_list.append({
@@ -108,7 +145,7 @@ class ODMeterSystem:
                     "channel": sample.channel,
                 })
         
-        resp = requests.delete("http://%s/api/sample/" % self._server_addr, json=req_list)
+        resp = self._request("DELETE", "sample/", json=req_list)
         if resp.status_code != 200:
             raise RuntimeError("%d: %s" % (resp.status_code, resp.text))
         
@@ -117,15 +154,19 @@ class ODMeterSystem:
         for sample in samples:
             req_sample_list.append({"uuid": sample.uuid})
 
-        resp = requests.post("http://%s/api/acqusition/" % self._server_addr, json={
+        req = {
             "name": name,
             "description": description,
             "interval": interval,
             "samples": req_sample_list,
             "user": self._user,
-        })
+        }
+        resp = self._request("POST", "acqusition/", json=req)
         if resp.status_code != 200:
             raise RuntimeError("%d: %s" % (resp.status_code, resp.text))
+
+        # The experiment is addressed by its name, no need to list the experiments to get it
+        return Experiment(name, req, self)
     
 class StandardCurve:
     def __init__(self, data):
@@ -153,10 +194,12 @@ class Sample:
     def uuid(self):
         return self._data["uuid"]
     
-    def data(self):
-        resp = requests.get("http://%s/api/sample/%s.%d/data/"
-                            % (self._system._server_addr, self.device, self.channel)).json()
-        return pd.DataFrame(resp["readings"])
+    def readings(self):
+        return self._system._request("GET", "sample/%s.%d/data/" % (self.device, self.channel)).json()["readings"]
+
+    def data(self, float32: bool = False):
+        import pandas as pd
+        return _compact(pd.DataFrame(self.readings()), float32)
 
 class Experiment:
     def __init__(self, name, data, system: ODMeterSystem):
@@ -171,60 +214,96 @@ class Experiment:
         return self._data["name"]
 
     def start(self):
-        resp = requests.get("http://%s/api/acqusition/%s/start/"
-                            % (self._system._server_addr, self.name))
+        resp = self._system._request("GET", "acqusition/%s/start/" % self.name)
         if resp.status_code != 200:
             raise RuntimeError("%d: %s" % (resp.status_code, resp.text))
 
     def stop(self):
-        resp = requests.get("http://%s/api/acqusition/%s/stop/"
-                            % (self._system._server_addr, self.name))
+        resp = self._system._request("GET", "acqusition/%s/stop/" % self.name)
         if resp.status_code != 200:
             raise RuntimeError("%d: %s" % (resp.status_code, resp.text))
 
     def close(self):
-        resp = requests.get("http://%s/api/acqusition/%s/close/"
-                            % (self._system._server_addr, self.name))
+        resp = self._system._request("GET", "acqusition/%s/close/" % self.name)
         if resp.status_code != 200:
             raise RuntimeError("%d: %s" % (resp.status_code, resp.text))
 
-    def data(self):
-        resp_list = requests.get("http://%s/api/acqusition/%s/data/"
-                            % (self._system._server_addr, self.name)).json()
-        
-        df_all = pd.DataFrame()
+    def iter_data(self, float32: bool = False):
+        """Yield the readings one sample at a time, so that large acquisitions can be processed without building a
+        single DataFrame."""
+        import pandas as pd
+        resp_list = self._system._request("GET", "acqusition/%s/data/" % self.name).json()
+
         for resp in resp_list:
             df = pd.DataFrame(resp["readings"])
-            df.t = pd.to_datetime(df.t)
-            df['sample_name'] = resp["info"]["name"]
-            t_start = df.t[0]
-            df['t_min'] = (df.t - t_start).dt.total_seconds() / 60
+            if len(df):
+                yield _with_elapsed_time(df, [resp["info"]["name"]], [len(df)], float32)
+
+    def data(self, float32: bool = False):
+        import pandas as pd
+        resp_list = self._system._request("GET", "acqusition/%s/data/" % self.name).json()
 
-            df_all = pd.concat([df_all, df])
+        # Build all the rows at once rather than concatenating one sample at a time
+        resp_list = [resp for resp in resp_list if resp["readings"]]
+        if not resp_list:
+            return pd.DataFrame()
 
-        return df_all
+        df = pd.DataFrame([reading for resp in resp_list for reading in resp["readings"]])
+        names = [resp["info"]["name"] for resp in resp_list]
+        lengths = [len(resp["readings"]) for resp in resp_list]
+
+        return _with_elapsed_time(df, names, lengths, float32)
+
+def _compact(df, float32=False):
+    """Use categories for the repeated labels, and optionally single precision for the measurements."""
+    for column in ["device", "sample_name"]:
+        if column in df:
+            df[column] = df[column].astype("category")
+    if float32:
+        for column in ["intensity", "intensity_blank", "raw_od", "converted_od"]:
+            if column in df:
+                df[column] = df[column].astype(np.float32)
+    return df
+
+def _with_elapsed_time(df, names, lengths, float32=False):
+    """Add the sample names and the minutes since each sample's first reading to the readings of consecutive samples,
+    <lengths> being the number of readings of each sample."""
+    import pandas as pd
+    df["t"] = pd.to_datetime(df["t"], format="ISO8601")
+    df["sample_name"] = np.repeat(names, lengths)
+
+    # First timestamp of each sample, repeated over its rows
+    starts = np.cumsum([0] + lengths[:-1])
+    t_start = df["t"].iloc[np.repeat(starts, lengths)].set_axis(df.index)
+    df["t_min"] = (df["t"] - t_start).dt.total_seconds() / 60
+
+    return _compact(df, float32)
 
 def load_data_file(exp_name):
-    df = pd.read_csv("Data/%s.csv" % exp_name, comment="#")
-    f=open("Data/%s.csv" % exp_name, "r")
-    meta=json.loads(f.readline()[1:])
-    f.close()
+    import pandas as pd
+
+    # Read the metadata line, then the table, from the same file handle
+    with open("Data/%s.csv" % exp_name, "r") as f:
+        meta = json.loads(f.readline()[1:])
+        df = pd.read_csv(f, comment="#")
     
-    df.device = df.device.apply(str)
-    df.channel = df.channel.apply(int)
+    df.device = df.device.astype(str)
+    df.channel = df.channel.astype(int)
     
-    df["sample_name"] = ""
-    for sample_info in meta["sample_info"]:
-        dev = sample_info["device"]
-        ch = sample_info["channel"]
-        name = sample_info["name"]
-        df.loc[(df.device == dev) & (df.channel == ch), "sample_name"] = name
+    # Look up the names of the samples by device and channel
+    sample_info = pd.DataFrame(meta["sample_info"], columns=["device", "channel", "name"])
+    sample_info = sample_info.astype({"device": str, "channel": int})
+    sample_info = sample_info.drop_duplicates(["device", "channel"], keep="last")
+    names = sample_info.set_index(["device", "channel"])["name"]
+
+    keys = pd.MultiIndex.from_arrays([df.device, df.channel])
+    df["sample_name"] = names.reindex(keys).fillna("").to_numpy()
     
-    for sample_name in df.sample_name.unique():
-        dev_list = df[df.sample_name == sample_name].device.unique()
-        if len(dev_list) > 1:
-            for dev in dev_list:
-                df.loc[(df.device==dev) & (df.sample_name==sample_name), "sample_name"] = "%s_%s" % (sample_name, dev)
+    # Add the device to names that are used on several devices
+    pairs = df[["sample_name", "device"]].drop_duplicates()
+    shared_names = pairs.sample_name[pairs.sample_name.duplicated()].unique()
+    shared = df.sample_name.isin(shared_names)
+    df.loc[shared, "sample_name"] = df.sample_name[shared] + "_" + df.device[shared]
     
     time_started = iso8601.parse_date(meta['time_started'])
     df['t_min'] = (pd.to_datetime(df.timestamp, format='ISO8601') - time_started).dt.total_seconds() / 60
@@ -0,0 +1,122 @@
+#!/bin/env python3
+'''Flag outliers as the measurements arrive.
+
+The notebook compares each OD to a median filter of the whole series (scipy.signal.medfilt), and flags it when its
+deviation is more than a threshold times the rolling median of the deviations. Here both medians are taken over the
+latest measurements only (trailing windows instead of centred ones), so that a measurement is flagged as soon as it
+arrives, in a time that does not depend on the length of the experiment.
+'''
+
+from collections import deque
+from heapq import heappush, heappop, heapify
+
+class running_median:
+    '''Median of the last <window> values. The values are split between a max-heap of the lower half and a min-heap of
+    the upper half; values leaving the window are only marked as removed, and dropped once they reach the top of their
+    heap. Each value costs O(log window).'''
+
+    __slots__ = ('window', 'values', 'low', 'high', 'low_size', 'high_size', 'removed', 'count')
+
+    def __init__(self, window):
+
+        self.window = window
+        self.values = deque() # (value, number) in the window, oldest first
+        self.low = [] # (-value, -number): the largest value on top
+        self.high = [] # (value, number): the smallest value on top
+        self.low_size = 0 # values in the window in each heap
+        self.high_size = 0
+        self.removed = set() # numbers of the values that left the window but are still in a heap
+        self.count = 0 # values seen, which numbers them so that equal values can be told apart
+
+    def top_low(self):
+        value, number = self.low[0]
+        return -value, -number
+
+    def prune(self):
+        '''Drop the removed values from the tops of the heaps.'''
+
+        while self.low and -self.low[0][1] in self.removed:
+            self.removed.discard(-heappop(self.low)[1])
+        while self.high and self.high[0][1] in self.removed:
+            self.removed.discard(heappop(self.high)[1])
+
+    def push(self, value):
+        '''Add a value, and return the median of the window.'''
+
+        item = (value, self.count)
+        self.count += 1
+        self.values.append(item)
+
+        if self.low_size and item <= self.top_low():
+            heappush(self.low, (-value, -item[1]))
+            self.low_size += 1
+        else:
+            heappush(self.high, item)
+            self.high_size += 1
+
+        # The oldest value leaves the window
+        if len(self.values) > self.window:
+            self.prune()
+            old = self.values.popleft()
+            self.removed.add(old[1])
+            if self.low_size and old <= self.top_low():
+                self.low_size -= 1
+            else:
+                self.high_size -= 1
+
+        # Keep the lower half as large as the upper half, or one larger
+        self.prune()
+        while self.low_size > self.high_size + 1:
+            value, number = self.top_low()
+            heappop(self.low)
+            heappush(self.high, (value, number))
+            self.low_size -= 1
+            self.high_size += 1
+            self.prune()
+
+        while self.high_size > self.low_size:
+            value, number = heappop(self.high)
+            heappush(self.low, (-value, -number))
+            self.high_size -= 1
+            self.low_size += 1
+            self.prune()
+
+        # Removed values deep in the heaps never reach the top: rebuild the heaps once they are mostly removed values
+        if len(self.low) + len(self.high) > 2 * self.window + 16:
+            self.rebuild()
+
+        if self.low_size > self.high_size:
+            return self.top_low()[0]
+        return (self.top_low()[0] + self.high[0][0]) / 2
+
+    def rebuild(self):
+
+        items = sorted(self.values)
+        half = (len(items) + 1) // 2
+
+        self.low = [(-value, -number) for value, number in items[:half]]
+        self.high = items[half:]
+        heapify(self.low)
+        heapify(self.high)
+        self.low_size, self.high_size = half, len(items) - half
+        self.removed = set()
+
+class outlier_detector:
+    '''Flag the measurements of a culture that deviate from the median of the last <window> ODs by more than
+    <threshold> times the median of the last <deviation_window> deviations (in absolute value).'''
+
+    __slots__ = ('threshold', 'ods', 'deviations')
+
+    def __init__(self, window = 25, deviation_window = 5, threshold = 3):
+
+        self.threshold = threshold
+        self.ods = running_median(window)
+        self.deviations = running_median(deviation_window)
+
+    def update(self, od):
+        '''Add a measurement, and return whether it is an outlier.'''
+
+        deviation = abs(od - self.ods.push(od))
+        typical_deviation = self.deviations.push(deviation)
+
+        return deviation > self.threshold * typical_deviation > 0
@@ -0,0 +1,377 @@
+#!/bin/env python3
+'''Write the recorded data to disk, and read it back.'''
+
+import os
+import time
+from datetime import datetime, timezone
+import queue
+import threading
+import traceback
+
+import numpy as np
+import iso8601
+
+import diagnostics
+
+pa = None # pyarrow (optional, for the columnar output), imported by load_pyarrow() as it is slow to import
+
+# columns: time, device, channel, name, intensity, intensity_blank, raw_od, converted_od, annotation, outlier
+HEADERS = ['time', 'device', 'channel', 'name', 'intensity', 'intensity_blank', 'raw_od', 'converted_od', 'annotation',
+           'outlier']
+
+COLUMNAR_EXTENSION = '.arrows'
+
+def parse_time(timestamp):
+    '''Convert an ISO 8601 timestamp to seconds since the epoch. Timestamps without a timezone are read as UTC.'''
+
+    try:
+        date = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return iso8601.parse_date(timestamp).timestamp()
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo = timezone.utc)
+
+    return date.timestamp()
+
+def epoch_seconds(timestamps):
+    '''Seconds since the epoch of a Series of ISO 8601 timestamps (see parse_time). Consecutive rows often share their
+    timestamp, so each distinct timestamp is only parsed once.'''
+
+    import pandas as pd
+
+    codes, unique = pd.factorize(timestamps)
+    seconds = np.fromiter(map(parse_time, unique), dtype = np.float64, count = len(unique))
+
+    return pd.Series(seconds[codes], index = timestamps.index)
+
+def load_pyarrow():
+    '''Import pyarrow on first use. Returns None if it is not installed.'''
+
+    global pa
+
+    if pa is None:
+        try:
+            import pyarrow
+        except ImportError:
+            return None
+        pa = pyarrow
+
+    return pa
+
+def create_record(file_path):
+    '''Create a new record file with tab-separated headers.'''
+
+    with open(file_path, 'w') as file:
+        print(f'Creating data file {file_path}.')
+        file.write('\t'.join(HEADERS) + '\n')
+
+def read_headers(file_path):
+    '''Columns of an existing record file.'''
+
+    with open(file_path, 'r') as file:
+        return file.readline().rstrip('\n').split('\t')
+
+def columnar_schema():
+    '''Same columns as the tab-separated file, with the time in seconds since the epoch and the repeated labels
+    dictionary-encoded.'''
+
+    labels = pa.dictionary(pa.int32(), pa.string())
+
+    return pa.schema([('time', pa.float64()), ('device', labels), ('channel', pa.int16()), ('name', labels),
+                      ('intensity', pa.float64()), ('intensity_blank', pa.float64()), ('raw_od', pa.float64()),
+                      ('converted_od', pa.float64()), ('annotation', labels), ('outlier', pa.bool_())])
+
+def columnar_paths(file_path):
+    '''Columnar files that go with a record file. Appending to an existing record creates a new numbered part.'''
+
+    stem = os.path.splitext(file_path)[0]
+    paths = [stem + COLUMNAR_EXTENSION] if os.path.exists(stem + COLUMNAR_EXTENSION) else []
+
+    while os.path.exists(f'{stem}.{len(paths)}{COLUMNAR_EXTENSION}'):
+        paths.append(f'{stem}.{len(paths)}{COLUMNAR_EXTENSION}')
+
+    return paths
+
+class columnar_writer:
+    '''Write the rows as record batches of an Arrow IPC stream. Unlike Parquet, a stream is readable up to its last
+    complete batch, so a crash only loses the rows that were not written yet.'''
+
+    def __init__(self, file_path, batch_rows = 4096):
+
+        existing = columnar_paths(file_path)
+        stem = os.path.splitext(file_path)[0]
+        self.path = f'{stem}.{len(existing)}{COLUMNAR_EXTENSION}' if existing else stem + COLUMNAR_EXTENSION
+
+        self.batch_rows = batch_rows
+        self.schema = columnar_schema()
+        self.file = open(self.path, 'wb')
+        self.stream = pa.ipc.new_stream(self.file, self.schema)
+        self.rows = []
+        self.times = []
+
+    def write(self, rows, times):
+        '''Buffer rows, writing a record batch whenever enough rows accumulated.'''
+
+        self.rows.extend(rows)
+        self.times.extend(times)
+
+        if len(self.rows) >= self.batch_rows:
+            self.write_batch()
+
+    def write_batch(self):
+
+        if not self.rows:
+            return
+
+        columns = list(zip(*self.rows))
+        arrays = [pa.array(self.times, pa.float64())]
+        for field, values in zip(list(self.schema)[1:], columns[1:]):
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array([str(value) for value in values]).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, field.type, from_pandas = True))
+
+        # Rows of a record file without outlier column
+        for field in list(self.schema)[len(arrays):]:
+            arrays.append(pa.nulls(len(self.times), field.type))
+
+        self.stream.write_batch(pa.record_batch(arrays, schema = self.schema))
+        self.rows = []
+        self.times = []
+
+    def flush(self):
+        '''Write the buffered rows and push them to disk.'''
+
+        self.write_batch()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+
+        self.write_batch()
+        self.stream.close()
+        self.file.close()
+
+class record_writer(threading.Thread):
+    '''Append batches of rows to the tab-separated record file from a background thread, so that a slow disk does not
+    hold up data reception. The file is flushed and synced to disk every <flush_interval> seconds or <flush_rows> rows,
+    whichever comes first, which bounds how much data can be lost in a crash.
+    With <columnar>, the rows are also written to an Arrow IPC stream next to the record file, in batches of up to
+    <batch_rows> rows.'''
+
+    def __init__(self, file_path, flush_interval = 5, flush_rows = 500, columnar = False, batch_rows = 4096):
+
+        super().__init__(daemon = True)
+
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+
+        # Opened here so that an unwritable file stops the recording before it starts
+        self.file = open(file_path, 'a')
+        self.error = None # set if the thread stops on an error
+
+        self.columnar = None
+        if columnar:
+            if load_pyarrow() is None:
+                print('\nWarning: pyarrow is not installed, the columnar file will not be written.\n')
+            else:
+                self.columnar = columnar_writer(file_path, batch_rows)
+                print(f'Writing columnar data to {self.columnar.path}.')
+
+        self.batches = queue.Queue()
+
+    def write(self, rows, times):
+        '''Queue a batch of rows (tuples of values in the order of HEADERS) to be written. <times> are the times of the
+        rows in seconds since the epoch.'''
+
+        if self.error is not None:
+            raise OSError(f'{self.file_path} is no longer written') from self.error
+
+        if rows:
+            self.batches.put((rows, times))
+
+    def close(self):
+        '''Write the remaining rows, then stop the thread.'''
+
+        self.batches.put(None)
+        self.join()
+
+    def run(self):
+
+        try:
+            self.write_batches()
+
+        except Exception as error: # anything but the write errors handled in write_batches
+            print(f'\nError: {self.file_path} is no longer written:')
+            traceback.print_exc()
+            self.error = error
+
+        finally:
+            self.file.close()
+            if self.columnar:
+                self.columnar.close()
+
+    def write_batches(self):
+        '''Write the queued rows until the writer is closed.'''
+
+        pending_rows = 0
+        last_flush = time.monotonic()
+        closing = False
+
+        while not closing:
+
+            # Wait for data, but wake up in time for the next flush
+            timeout = max(0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                batches = [self.batches.get(timeout = timeout)]
+            except queue.Empty:
+                batches = []
+
+            # Take everything that piled up in the meantime
+            while True:
+                try:
+                    batches.append(self.batches.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batches:
+                closing = True
+                batches = batches[:batches.index(None)]
+
+            start = time.perf_counter()
+
+            # Serialise all the rows at once
+            lines = ['\t'.join(map(str, row)) for rows, times in batches for row in rows]
+
+            try:
+                if lines:
+                    self.file.write('\n'.join(lines) + '\n')
+                    pending_rows += len(lines)
+
+                if self.columnar:
+                    for rows, times in batches:
+                        self.columnar.write(rows, times)
+
+                if pending_rows and (closing or pending_rows >= self.flush_rows or \
+                                     time.monotonic() - last_flush >= self.flush_interval):
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    if self.columnar:
+                        self.columnar.flush()
+                    pending_rows = 0
+
+                if not pending_rows:
+                    last_flush = time.monotonic()
+
+                if batches:
+                    diagnostics.record('file_write', time.perf_counter() - start)
+                    diagnostics.count('rows_written', len(lines))
+
+            except (OSError, ValueError, TypeError): # Arrow errors derive from these
+                print(f'\nWarning: error while writing to {self.file_path}:')
+                traceback.print_exc()
+
+def count_rows(file_path, chunk_size = 1 << 24):
+    '''Number of complete rows of a tab-separated record file, not counting the headers.'''
+
+    lines = 0
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            lines += chunk.count(b'\n')
+
+    return max(lines - 1, 0)
+
+def load_record(file_path, columns = None):
+    '''Read a record file as a DataFrame, with the time in seconds since the epoch, keeping only <columns> if given.
+    The columnar files are used when they hold all the rows of the tab-separated file, otherwise (e.g. some sessions
+    were recorded without columnar output) the tab-separated file is parsed.'''
+
+    import pandas as pd
+
+    paths = columnar_paths(file_path)
+
+    if paths and load_pyarrow() is not None:
+        schema = columnar_schema()
+        tables = [schema.empty_table()]
+        for path in paths:
+            with pa.memory_map(path) as source:
+                try:
+                    for batch in pa.ipc.open_stream(source):
+                        table = pa.Table.from_batches([batch])
+
+                        # Parts written before the outlier column existed
+                        for field in schema:
+                            if field.name not in table.column_names:
+                                table = table.append_column(field, pa.nulls(len(table), field.type))
+
+                        tables.append(table)
+                except (pa.ArrowInvalid, OSError): # truncated by a crash: keep the complete batches
+                    pass
+
+        table = pa.concat_tables(tables)
+        if len(table) == count_rows(file_path):
+            return (table.select(columns) if columns else table).to_pandas()
+
+        print(f'The columnar files of {file_path} do not hold all its rows, reading the tab-separated file.')
+
+    df = pd.read_csv(file_path, sep = '\t', usecols = columns, keep_default_na = False,
+                     dtype = {'time': str, 'device': str, 'name': str})
+    if 'time' in df:
+        df['time'] = epoch_seconds(df['time'])
+
+    return df
+
+def read_history(file_path, cultures, chunk_size = 1 << 24):
+    '''Read back the measurements of a record file, to resume an interrupted recording. <cultures> is a set of
+    (device, channel, name) to look for. Returns a dict mapping each of them to arrays of times (seconds since the
+    epoch), ODs, and whether they were flagged as outliers. The file is read in large chunks, and only the columns
+    needed are parsed.'''
+
+    history = {}
+
+    # Only keep the rows of the cultures being recorded, matching the raw text of the columns
+    wanted = {(device, str(channel), name): (device, channel, name) for device, channel, name in cultures}
+    times = {key: [] for key in cultures}
+    ods = {key: [] for key in cultures}
+    outliers = {key: [] for key in cultures}
+
+    last_time, last_epoch = None, None # consecutive rows often share a timestamp
+    remainder = ''
+
+    with open(file_path, 'r') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop() # incomplete last line
+
+            for line in lines:
+                fields = line.split('\t', 8)
+                if len(fields) < 8:
+                    continue
+
+                key = wanted.get((fields[1], fields[2], fields[3]))
+                if key is None: # header, other cultures
+                    continue
+
+                try:
+                    od = float(fields[7])
+                    if fields[0] != last_time:
+                        last_time, last_epoch = fields[0], parse_time(fields[0])
+                except ValueError: # incomplete row, e.g. written during a crash
+                    continue
+
+                times[key].append(last_epoch)
+                ods[key].append(od)
+                # The outlier column follows the annotation
+                outliers[key].append(len(fields) > 8 and fields[8].endswith('\tTrue'))
+
+            if not chunk:
+                break
+
+    for key in cultures:
+        if times[key]:
+            history[key] = (np.array(times[key]), np.array(ods[key]), np.array(outliers[key], dtype = bool))
+
+    return history
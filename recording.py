@@ -0,0 +1,586 @@
+#!/bin/env python3
+'''Receive data from the OD readers. This module does not depend on Qt, so that recording can run without a window.'''
+
+import os
+import queue
+import time
+import math
+import mmap
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from random import random
+import traceback
+
+import numpy as np
+
+import mem
+import diagnostics
+from record_file import record_writer, parse_time, read_history, read_headers
+from ingestion import host_reader, reading
+from lod import level, decimation_pyramid
+from growth import growth_filter, doubling_times
+from outliers import outlier_detector
+
+class spill_store:
+    '''Measurements moved out of memory, as (time, value) pairs in an anonymous temporary file (deleted when closed),
+    read back through a memory map, so that only the pages needed are loaded. The file is created when points are
+    first moved, with room for twice as many, and written through the map; when it is full, the points are copied to a
+    file twice as large. Only the map is kept open, which holds a single file descriptor.'''
+
+    __slots__ = ('folder', 'size', 'pairs', '_map')
+
+    def __init__(self, folder = None):
+        self.folder = folder or None # None: the system's temporary folder
+        self.size = 0
+        self.pairs = None # array of (time, value) on the map, with room for more points
+        self._map = None
+
+    def allocate(self, capacity):
+        '''Move the points to a new file with room for <capacity> points.'''
+
+        length = capacity * 2 * 8
+        with tempfile.TemporaryFile(dir = self.folder) as file:
+            # Reserve the disk space now: writing to a sparse file through a map crashes when the disk is full
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(file.fileno(), 0, length)
+            else:
+                file.truncate(length)
+            new_map = mmap.mmap(file.fileno(), length) # the map keeps the file open
+
+        pairs = np.frombuffer(new_map, dtype = np.float64).reshape(capacity, 2)
+        if self.size:
+            pairs[:self.size] = self.pairs[:self.size]
+
+        old_map = self._map
+        self.pairs, self._map = pairs, new_map
+
+        # Close the old map, unless the plots still use it: it is then closed when they let it go
+        if old_map is not None:
+            try:
+                old_map.close()
+            except BufferError:
+                pass
+
+    def append(self, times, values):
+
+        n = len(times)
+        if self.pairs is None or self.size + n > len(self.pairs):
+            self.allocate(2 * (self.size + n))
+
+        self.pairs[self.size:self.size + n, 0] = times
+        self.pairs[self.size:self.size + n, 1] = values
+        self.size += n
+
+    def view(self, size):
+        '''Times and values of the first <size> points moved.'''
+
+        pairs = self.pairs
+        if not size or pairs is None:
+            return np.empty(0), np.empty(0)
+
+        return pairs[:size, 0], pairs[:size, 1]
+
+class stored_series:
+    '''Points of a time series, kept in preallocated arrays that grow geometrically; <times> and <values> are views on
+    the most recent points. <lod> holds decimated versions of the series for plotting.
+    With <memory_points>, only about that many points are kept in memory, at each level of detail: older raw points
+    are moved to temporary files in <spill_folder>, from where they are read back when zooming in.'''
+
+    __slots__ = ('raw', 'spill', 'lod', 'memory_points')
+
+    def __init__(self, capacity = 1024, memory_points = None, spill_folder = None):
+
+        self.raw = level(capacity)
+        self.spill = spill_store(spill_folder)
+        self.memory_points = memory_points or None
+
+        self.lod = decimation_pyramid(retention = self.memory_points)
+
+    @property
+    def size(self):
+        '''Number of points, including the ones moved out of memory.'''
+        return self.raw.size
+
+    @property
+    def times(self):
+        return self.raw.times
+
+    @property
+    def values(self):
+        return self.raw.values
+
+    def append(self, time, value):
+
+        self.raw.append(time, value)
+
+        # Summarise the points once they fill a bucket
+        if self.raw.size % self.lod.factor == 0:
+            self.lod.update(self.raw)
+            self.spill_old()
+
+    def extend(self, times, values):
+
+        self.raw.extend(times, values)
+        self.lod.update(self.raw)
+        self.spill_old()
+
+    def spill_old(self):
+        '''Move the oldest points to disk when there are too many in memory. They are written before being dropped,
+        so that a reader always finds them in one place or the other.'''
+
+        if not self.memory_points or not self.lod.consumed:
+            return
+
+        in_memory = self.raw.size - self.raw.offset
+        if in_memory > 2 * self.memory_points:
+            n = min(in_memory - self.memory_points, self.lod.consumed[0] - self.raw.offset)
+            self.spill.append(self.raw.times[:n], self.raw.values[:n])
+            self.raw.drop(n)
+
+    def last(self, size = None):
+        '''Time and value of the last point, or of the point number <size> if given.'''
+
+        times, values, offset, raw_size = self.raw.data
+        index = min(raw_size if size is None else size, raw_size) - 1 - offset
+
+        if index < 0: # moved out of memory since
+            times, values = self.spill.view(offset)
+            index += offset
+
+        return times[index], values[index]
+
+    def render(self, budget, t_start = None, t_end = None, size = None):
+        '''Points to plot between <t_start> and <t_end>, up to the last point or to the point number <size>, at the
+        finest level of detail that fits in <budget> points (see lod.decimation_pyramid.render).'''
+
+        size = self.raw.size if size is None else min(size, self.raw.size)
+
+        times, values, offset = self.raw.snapshot(size)
+        history = self.spill.view(min(offset, size)) if offset else None
+
+        last_time = self.last(size)[0]
+        t_end = last_time if t_end is None else min(t_end, last_time)
+
+        return self.lod.render(times, values, budget, t_start, t_end, history)
+
+class culture:
+    '''Store information about a single reactor.
+    <measurements> holds the ODs (times in seconds since the epoch), and <growth_rates> the growth rates (doublings per
+    minute) estimated by the recorder after each measurement. <index> is the culture's place in the recorder's filter,
+    and <outliers> its outliers.outlier_detector, if outliers are flagged.'''
+
+    __slots__ = ('name', 'growth_rate', 'index', 'outliers', 'last_time', 'measurements', 'growth_rates')
+
+    def __init__(self, name, capacity = 1024, memory_points = None, spill_folder = None, index = None, outliers = None):
+        self.name = name
+        self.growth_rate = 1.05
+        self.index = index
+        self.outliers = outliers
+        self.last_time = -float('inf') # time of the last measurement received, even if it was not kept (hidden outlier)
+
+        self.measurements = stored_series(capacity, memory_points, spill_folder)
+        self.growth_rates = stored_series(capacity, memory_points, spill_folder)
+
+    @property
+    def size(self):
+        '''Number of measurements, including the ones moved out of memory.'''
+        return self.measurements.size
+
+    @property
+    def times(self):
+        return self.measurements.times
+
+    @property
+    def ods(self):
+        return self.measurements.values
+
+    def append(self, time, od):
+        '''Add one measurement.'''
+        self.measurements.append(time, od)
+        self.last_time = time
+
+    def extend(self, times, ods):
+        '''Add many measurements at once.'''
+        self.measurements.extend(times, ods)
+        if len(times):
+            self.last_time = max(self.last_time, times[-1])
+
+    def last(self, size = None, doubling_time = False):
+        '''Time and OD of the last measurement, or of the measurement number <size> if given. With <doubling_time>,
+        the estimated doubling time (min) instead of the OD.'''
+
+        if doubling_time:
+            last_time, growth_rate = self.growth_rates.last(size)
+            return last_time, float(doubling_times(growth_rate))
+
+        return self.measurements.last(size)
+
+    def render(self, budget, t_start = None, t_end = None, size = None, doubling_time = False):
+        '''Points of the OD curve to plot (see stored_series.render), or with <doubling_time> of the estimated doubling
+        time, computed from the decimated growth rates.'''
+
+        if doubling_time:
+            times, growth_rates = self.growth_rates.render(budget, t_start, t_end, size)
+            return times, doubling_times(growth_rates)
+
+        return self.measurements.render(budget, t_start, t_end, size)
+
+class recorder:
+    '''Receive data from the OD readers and write it to the record file.
+    The window subclasses it to take the labels, the annotation and the state of the record button from its widgets,
+    and to redraw the plots when new data arrives.'''
+
+    def __init__(self):
+
+        super().__init__()
+
+        self.annotation = '' # written in the last column of the record file
+        self.resume = False # reload the measurements already in the record file before recording
+        self.updated_at = None # time.perf_counter() of the last notification not plotted yet
+
+    def initialize_cultures(self, labels):
+        '''Create the cultures from <labels>, which maps (device, channel) to the culture's label. If a label is
+        missing or empty, the reactor is inactive.'''
+       
+        # Create data structures to store the measurements
+        mem.cultures = {}
+        n_cultures = 0
+
+        for device in mem.devices:
+
+            dev_cultures = []
+
+            for channel in mem.channels:
+
+                reactor_label = labels.get((device, channel), '')
+                
+                # Make a culture object to store temporary data
+                if reactor_label:
+                    outliers = outlier_detector(mem.config['outlier_window'], mem.config['outlier_deviation_window'],
+                                                mem.config['outlier_threshold']) if mem.config['outlier_threshold'] else None
+                    dev_cultures.append(culture(reactor_label, memory_points = mem.config['memory_points'],
+                                                spill_folder = mem.config['spill_folder'], index = n_cultures,
+                                                outliers = outliers))
+                    n_cultures += 1
+
+                else: # don't record channels with no label
+                    dev_cultures.append(None)
+
+            # Is the device active?
+            if any(dev_cultures):
+
+                print(f'Device {device} is active.')
+                mem.active_devices.append(device)
+                mem.cultures[device] = dev_cultures
+
+            else:
+                print(f'Device {device} is inactive.')
+
+        # Growth rates of all the cultures, estimated together after each batch of measurements
+        self.growth_filter = growth_filter(n_cultures, mem.config['initial_doubling_time'],
+                                           mem.config['growth_rate_drift'], mem.config['od_noise'])
+
+    def clear_backend(self, api):
+        '''Clear the backend of a host of any existing data.'''
+        
+        # Check for any existing experiments
+        experiments = api.experiments()
+        if experiments:
+            print('\nWarning: the backend is already listing experiments. You should restart it and restart this application.')
+
+        # Stop the experiment if any
+        for experiment in experiments:
+            try:
+                experiment.close()
+            except:
+                
+                print('\nWarning: there was an error while clearing the backend:')
+                traceback.print_exc()
+
+                print('If the problem persists, try restarting the backend.\n')
+
+        # Remove the samples
+        api.remove_sample(api.samples())
+                
+    def start_backend(self, standard_curve, recording_interval, experiment_name, progress = print):
+        '''Connect to the API and tell the backed to start recording data. <progress> is called with a description of
+        each step. The hosts are set up at the same time.'''
+
+        if not mem.config['simulation']:
+
+            mem.experiments = {}
+
+            # Hosts with active devices
+            hosts = [host for host in mem.hosts if any(mem.device_hosts[device][0] == host for device in mem.active_devices)]
+
+            with ThreadPoolExecutor(max_workers = len(hosts)) as executor:
+                for result in executor.map(lambda host: self.start_host(host, standard_curve, recording_interval,
+                                                                        experiment_name, progress), hosts):
+                    pass # re-raise the errors, if any
+
+            print(f'Started the experiment ({recording_interval}s interval).')
+
+    def start_host(self, host, standard_curve, recording_interval, experiment_name, progress = print):
+        '''Create the samples and the experiment on one host, and start it.'''
+
+        api = mem.apis[host]
+
+        # Clear the backend of any existing data
+        progress(f'Clearing the backend of {host}.')
+        self.clear_backend(api)
+
+        # Create all the samples on the backend side in a single request
+        progress(f'Creating the samples on {host}.')
+        devices, channels, names = [], [], []
+        for device in mem.active_devices:
+            device_host, label = mem.device_hosts[device]
+            if device_host != host:
+                continue
+
+            for channel in mem.channels:
+                if mem.cultures[device][channel]:
+                    devices.append(label)
+                    channels.append(channel + 1) # channel is one-indexed in backend, zero-indexed in frontend
+                    names.append(mem.cultures[device][channel].name)
+
+        samples = api.create_samples(devices, channels, names, [standard_curve] * len(devices))
+        if samples is None: # the backend didn't send back the samples
+            samples = api.samples()
+
+        # Create the experiment on the backend side
+        progress(f'Creating the experiment on {host}.')
+        backend_experiment_name = f'{experiment_name}_{round(datetime.now().timestamp())}' # avoid name conflicts
+        mem.experiments[host] = api.create_experiment(backend_experiment_name, samples = samples,
+                                                      interval = recording_interval)
+
+        # Tell the backend to start recording
+        progress(f'Starting the experiment on {host} ({recording_interval}s interval).')
+        mem.experiments[host].start()
+
+    def is_recording(self):
+        '''Whether the recording loop should go on.'''
+
+        return mem.running
+
+    def current_annotation(self):
+        '''Annotation written in the last column of the record file.'''
+
+        return self.annotation
+
+    def notify(self):
+        '''Called when new data is available for plotting.'''
+
+    def record(self):
+        '''Run the data recording loop, until is_recording() returns False. mem.running is set by the caller before
+        starting the backend, so that a stop requested while starting up is not overridden.'''
+
+        diagnostics.reset()
+
+        # Listen to the websocket of each host, all feeding the same queue
+        self.readings = queue.Queue()
+        self.readers = []
+        writer = None
+
+        try:
+            if not mem.config['simulation']:
+                for host in mem.experiments:
+                    reader = host_reader(host, self.readings, reconnect_delay = mem.config['reconnect_delay'],
+                                         max_reconnect_delay = mem.config['max_reconnect_delay'])
+                    reader.connect()
+                    self.readers.append(reader)
+
+                for reader in self.readers:
+                    reader.start()
+
+            # Last active device of each host, after which the plots are refreshed
+            last_devices = {mem.device_hosts[device][0]: device for device in mem.active_devices}
+
+            # Reload the measurements already in the file when appending to it
+            if self.resume:
+                self.load_history()
+
+            # Files recorded before outliers were flagged have no outlier column: keep their layout when appending
+            outlier_column = 'outlier' in read_headers(mem.file_path)
+            hide_outliers = mem.config['hide_outliers']
+
+            # Write the record file from a separate thread
+            writer = record_writer(mem.file_path, mem.config['flush_interval'], mem.config['flush_rows'],
+                                   mem.config['columnar_output'], mem.config['columnar_batch_rows'])
+            writer.start()
+
+            # Backlogs: they grow when a stage falls behind the readers
+            diagnostics.gauge('readings_queue', self.readings.qsize)
+            diagnostics.gauge('writer_queue', writer.batches.qsize)
+
+            # Run the data request loop, unless recording was stopped while starting up (mem.running is set before)
+            while self.is_recording():
+
+                # Wait for the next data point from the readers
+                if not mem.config['simulation']:
+                    data = self.request_data()
+                else:
+                    data = self.request_simulated_data()
+
+                if not data:
+                    continue
+
+                start = time.perf_counter()
+                annotation = self.current_annotation()
+
+                # Data is received as a list of reactors, batched by device
+                rows = []
+                times = []
+                new_cultures = [] # cultures, times and ODs of the measurements that are not outliers
+                new_times = []
+                new_ods = []
+                n_outliers = 0
+                for measurement in data:
+                    device = measurement.device
+                    channel = measurement.channel - 1 # one-indexed in backend, zero-indexed in frontend
+
+                    if device not in mem.cultures or not mem.cultures[device][channel]: # not recorded
+                        continue
+
+                    reactor = mem.cultures[device][channel]
+                    timestamp = measurement.t
+                    od = measurement.converted_od
+
+                    # Add the data to memory (time is parsed once here, the record file keeps the original string)
+                    epoch = parse_time(timestamp)
+                    if epoch <= reactor.last_time:
+                        continue # already received, e.g. fetched again after a reconnection
+
+                    # Readings without a valid OD are kept, but left out of the outlier detection
+                    valid = od is not None and math.isfinite(od)
+                    outlier = reactor.outliers.update(od) if reactor.outliers and valid else False
+                    n_outliers += outlier
+
+                    if outlier and hide_outliers:
+                        reactor.last_time = epoch
+                    else:
+                        reactor.append(epoch, od)
+
+                    times.append(epoch)
+                    if not outlier:
+                        new_cultures.append(reactor)
+                        new_times.append(epoch)
+                        new_ods.append(od)
+
+                    # Row of the record file
+                    row = (timestamp, device, channel, reactor.name, measurement.intensity, measurement.intensity_blank,
+                           measurement.raw_od, od, annotation)
+                    rows.append(row + (outlier,) if outlier_column else row)
+
+                # Write the data to the record file
+                writer.write(rows, times)
+
+                # Update the growth rate estimates of the cultures measured, leaving the outliers out
+                if new_cultures:
+                    growth_start = time.perf_counter()
+                    indices = [measured.index for measured in new_cultures]
+                    filtered_ods, growth_rates = self.growth_filter.update(indices, new_times, new_ods)
+                    for measured, epoch, growth_rate in zip(new_cultures, new_times, growth_rates.tolist()):
+                        measured.growth_rates.append(epoch, growth_rate)
+                    diagnostics.record('growth_filter', time.perf_counter() - growth_start)
+
+                diagnostics.record('process', time.perf_counter() - start)
+                diagnostics.count('readings', len(rows))
+                if n_outliers:
+                    diagnostics.count('outliers', n_outliers)
+
+                # Emit the custom signal to indicate that new data is available (only after reading the last device)
+                if data[-1].device in last_devices.values() or mem.config['always_refresh']:
+                    if self.updated_at is None:
+                        self.updated_at = time.perf_counter()
+                    diagnostics.count('data_updated')
+                    self.notify()
+
+        finally:
+            # When recording is stopped (e.g. the record button is unchecked) or fails, stop the readers and the writer
+            print('Recording stopped.')
+            mem.running = False
+
+            for reader in self.readers:
+                reader.stop()
+            if writer is not None:
+                writer.close()
+        
+    def load_history(self):
+        '''Fill the cultures with the measurements of the record file that match their device, channel and name.'''
+
+        cultures = {(device, channel, mem.cultures[device][channel].name) for device in mem.active_devices \
+                    for channel in mem.channels if mem.cultures[device][channel]}
+
+        start = time.monotonic()
+        history = read_history(mem.file_path, cultures)
+
+        for (device, channel, name), (times, ods, outliers) in history.items():
+            reactor = mem.cultures[device][channel]
+
+            if mem.config['hide_outliers']:
+                reactor.extend(times[~outliers], ods[~outliers])
+            else:
+                reactor.extend(times, ods)
+            reactor.last_time = times[-1]
+
+            # Resume the outlier detection where it stopped
+            if reactor.outliers:
+                valid_ods = ods[np.isfinite(ods)]
+                for od in valid_ods[-(reactor.outliers.ods.window + reactor.outliers.deviations.window):].tolist():
+                    reactor.outliers.update(od)
+
+        # Estimate the growth rates over the history, all the cultures together, leaving the outliers out
+        if history:
+            keys = list(history)
+            inliers = [~history[key][2] for key in keys]
+            lengths = [int(kept.sum()) for kept in inliers]
+            indices = np.repeat([mem.cultures[device][channel].index for device, channel, name in keys], lengths)
+            all_times = np.concatenate([history[key][0][kept] for key, kept in zip(keys, inliers)])
+            all_ods = np.concatenate([history[key][1][kept] for key, kept in zip(keys, inliers)])
+
+            filtered_ods, growth_rates = self.growth_filter.update(indices, all_times, all_ods)
+
+            for (device, channel, name), times, culture_growth_rates in zip(keys, np.split(all_times, np.cumsum(lengths)[:-1]),
+                                                                            np.split(growth_rates, np.cumsum(lengths)[:-1])):
+                mem.cultures[device][channel].growth_rates.extend(times, culture_growth_rates)
+
+        n_points = sum(len(times) for times, ods, outliers in history.values())
+        print(f'Loaded {n_points} measurements from {mem.file_path} in {time.monotonic() - start:.1f}s.')
+
+        self.notify()
+
+    def request_data(self, timeout = 1):
+        '''Wait for the readings of the next measurement of any host. Returns an empty list if nothing arrived within
+        <timeout> seconds, so that the recording loop can check whether it should stop.
+        The data is a list of ingestion.reading records, each containing the readings for a single reactor:
+        t, device, channel, intensity, intensity_blank, raw_od, converted_od.
+        '''
+        start = time.perf_counter()
+        try:
+            host, data = self.readings.get(timeout = timeout)
+        except queue.Empty:
+            return []
+        finally:
+            diagnostics.record('wait_readings', time.perf_counter() - start)
+
+        return data
+
+    def request_simulated_data(self):
+        time.sleep(mem.config['sim_data_rate'])
+
+        simulated_data = []
+        for device in mem.active_devices:
+            for channel in mem.channels:
+
+                if mem.cultures[device][channel]:
+                    new_time = datetime.now(timezone.utc).isoformat()
+                    if mem.cultures[device][channel].size:
+                        new_od = mem.cultures[device][channel].ods[-1] * mem.cultures[device][channel].growth_rate
+                    else:
+                        new_od = 0.01 * random()
+
+                    simulated_data.append(reading(new_time, device, channel + 1, new_od, 0, 0, new_od))
+
+        return simulated_data                
+
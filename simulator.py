@@ -0,0 +1,330 @@
+#!/bin/env python3
+'''Stand-in for the readers' backend, to try Bloomie and measure its throughput without the hardware.
+
+Serves the same HTTP API (/api/config/, /api/device/, /api/sample/, /api/acqusition/) and websocket (/api/ws/) as the
+backend, with only the standard library. Once an experiment is started, every sample is measured every <interval>
+seconds of simulated time; <speed> compresses time, e.g. a 10s interval at speed 100 sends a measurement every 0.1s,
+with timestamps 10s apart. The cultures follow logistic growth with Gaussian noise and occasional spikes, drawn from a
+seeded random generator so that runs are reproducible.
+
+Usage: python simulator.py [--port 8080] [--devices 4] [--channels 8] [--speed 1] [--users Avik]
+Then connect Bloomie to 127.0.0.1:8080.
+'''
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import queue
+import random
+import struct
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+class culture_model:
+    '''Logistic growth of one sample, with measurement noise and outliers.'''
+
+    __slots__ = ('od_zero', 'growth_rate', 'carrying_capacity', 'noise', 'outliers', 'blank', 'random')
+
+    def __init__(self, seed, noise = 0.002, outliers = 0.01):
+        '''<seed> is any string or number, the same seed giving the same culture.'''
+
+        self.random = random.Random(seed)
+        self.od_zero = self.random.uniform(0.005, 0.02)
+        self.growth_rate = math.log(2) / self.random.uniform(1800, 3600) # /s, doubling time of 30 to 60 min
+        self.carrying_capacity = self.random.uniform(0.8, 1.5)
+        self.noise = noise # standard deviation of the OD
+        self.outliers = outliers # probability of a spike
+        self.blank = self.random.uniform(900, 1100) # intensity without culture
+
+    def measure(self, elapsed):
+        '''Reading after <elapsed> seconds of growth.'''
+
+        growth = math.exp(-self.growth_rate * elapsed)
+        od = self.carrying_capacity / (1 + (self.carrying_capacity / self.od_zero - 1) * growth)
+        od += self.random.gauss(0, self.noise)
+
+        if self.random.random() < self.outliers:
+            od *= 1 + self.random.uniform(0.5, 2)
+
+        intensity = self.blank * 10 ** -od
+        return {'intensity': intensity, 'intensity_blank': self.blank, 'raw_od': od, 'converted_od': od}
+
+class reader_simulator:
+    '''Simulated backend serving <devices> devices of <channels> channels on 127.0.0.1:<port> (0 picks a free port).'''
+
+    def __init__(self, port = 8080, devices = 4, channels = 8, speed = 1, noise = 0.002, outliers = 0.01, seed = 0,
+                 users = ('Avik',), standard_curves = ('Ecoli-ReusableGlassTube',)):
+
+        self.devices = [str(device + 1) for device in range(devices)]
+        self.channels = channels
+        self.speed = speed
+        self.noise = noise
+        self.outliers = outliers
+        self.seed = seed
+        self.users = list(users)
+        self.standard_curves = list(standard_curves)
+
+        self.lock = threading.Lock()
+        self.samples = {} # (device, channel): sample description
+        self.readings = {} # (device, channel): list of readings
+        self.experiments = {} # name: experiment description
+        self.acquisitions = {} # name: threading.Event that stops the acquisition
+        self.clients = [] # one queue of frames per websocket connection
+
+        handler = type('handler', (request_handler,), {'simulator': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server.server_address
+
+    def start(self):
+        '''Serve from a background thread.'''
+
+        threading.Thread(target = self.serve, daemon = True).start()
+
+    def serve(self):
+
+        print(f'Simulating {len(self.devices)} devices of {self.channels} channels at {self.address} (speed {self.speed}).')
+        self.server.serve_forever()
+
+    def stop(self):
+
+        for stopped in self.acquisitions.values():
+            stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def broadcast(self, readings):
+        '''Send a frame to every websocket client.'''
+
+        frame = json.dumps({'readings': readings}).encode()
+        with self.lock:
+            for client in self.clients:
+                client.put(frame)
+
+    def acquire(self, name, stopped):
+        '''Measure the samples of an experiment until it is stopped, sending one frame per device.'''
+
+        experiment = self.experiments[name]
+        interval = experiment['interval']
+        uuids = set(experiment['sample_uuids'])
+        keys = [key for key, sample in self.samples.items() if sample['uuid'] in uuids]
+
+        models = {key: culture_model(f'{self.seed}/{key[0]}.{key[1]}', self.noise, self.outliers) for key in keys}
+        start = datetime.now(timezone.utc)
+        step = 0
+
+        while not stopped.wait(interval / self.speed if step else 0):
+
+            elapsed = step * interval # simulated time
+            timestamp = (start + timedelta(seconds = elapsed)).isoformat()
+
+            for device in self.devices:
+                readings = [{'t': timestamp, 'device': device, 'channel': channel, **models[device, channel].measure(elapsed)}
+                            for channel in range(1, self.channels + 1) if (device, channel) in models]
+                if not readings:
+                    continue
+
+                with self.lock:
+                    for reading in readings:
+                        if (device, reading['channel']) in self.readings: # unless the sample was removed
+                            self.readings[device, reading['channel']].append(reading)
+                self.broadcast(readings)
+
+            step += 1
+
+class request_handler(BaseHTTPRequestHandler):
+    '''Answer the requests of one connection. <simulator> is set on the subclass made for each simulator.'''
+
+    protocol_version = 'HTTP/1.1'
+    simulator = None
+
+    def log_message(self, format, *args):
+        pass # don't print every request
+
+    def reply(self, data, status = 200):
+
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def route(self):
+        return [part for part in self.path.split('?')[0].split('/') if part][1:] # without the leading "api"
+
+    def do_GET(self):
+
+        simulator = self.simulator
+        path = self.route()
+
+        if path == ['ws']:
+            return self.serve_websocket()
+
+        if path == ['config']:
+            return self.reply({'users': [{'name': user} for user in simulator.users],
+                               'standard_curves': [{'name': curve} for curve in simulator.standard_curves]})
+
+        if path == ['device']:
+            return self.reply([{'label': device, 'channels': [{'channel': channel + 1} for channel in range(simulator.channels)]}
+                               for device in simulator.devices])
+
+        with simulator.lock:
+
+            if path == ['sample']:
+                return self.reply(list(simulator.samples.values()))
+
+            if len(path) == 3 and path[0] == 'sample' and path[2] == 'data':
+                device, channel = path[1].rsplit('.', 1)
+                return self.reply({'readings': list(simulator.readings.get((device, int(channel)), []))})
+
+            if path == ['acqusition']:
+                return self.reply([{'name': name, **experiment} for name, experiment in simulator.experiments.items()])
+
+            if len(path) == 3 and path[0] == 'acqusition' and path[1] in simulator.experiments:
+                name, action = path[1], path[2]
+
+                if action == 'start':
+                    if name not in simulator.acquisitions:
+                        simulator.acquisitions[name] = threading.Event()
+                        threading.Thread(target = simulator.acquire, args = (name, simulator.acquisitions[name]),
+                                         daemon = True).start()
+                    return self.reply({})
+
+                if action in ('stop', 'close'):
+                    if name in simulator.acquisitions:
+                        simulator.acquisitions.pop(name).set()
+                    if action == 'close':
+                        del simulator.experiments[name]
+                    return self.reply({})
+
+                if action == 'data':
+                    uuids = set(simulator.experiments[name]['sample_uuids'])
+                    return self.reply([{'info': sample, 'readings': list(simulator.readings[key])}
+                                       for key, sample in simulator.samples.items() if sample['uuid'] in uuids])
+
+        self.reply({'detail': 'Not found'}, 404)
+
+    def do_POST(self):
+
+        simulator = self.simulator
+        path = self.route()
+        request = self.read_json()
+
+        with simulator.lock:
+
+            if path == ['sample']:
+                created = []
+                for sample in request:
+                    key = (str(sample['device']), int(sample['channel']))
+                    simulator.samples[key] = {**sample, 'device': key[0], 'channel': key[1], 'uuid': str(uuid.uuid4())}
+                    simulator.readings[key] = []
+                    created.append(simulator.samples[key])
+                return self.reply(created)
+
+            if path == ['acqusition']:
+                simulator.experiments[request['name']] = {'interval': request['interval'],
+                                                          'sample_uuids': [sample['uuid'] for sample in request['samples']]}
+                return self.reply({})
+
+        self.reply({'detail': 'Not found'}, 404)
+
+    def do_DELETE(self):
+
+        simulator = self.simulator
+        path = self.route()
+        request = self.read_json()
+
+        if path == ['sample']:
+            with simulator.lock:
+                for sample in request or []:
+                    key = (str(sample['device']), int(sample['channel']))
+                    simulator.samples.pop(key, None)
+                    simulator.readings.pop(key, None)
+            return self.reply({})
+
+        self.reply({'detail': 'Not found'}, 404)
+
+    def serve_websocket(self):
+        '''Upgrade the connection to a websocket, then send it the frames of the acquisitions.'''
+
+        key = self.headers['Sec-WebSocket-Key']
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        frames = queue.Queue()
+        with self.simulator.lock:
+            self.simulator.clients.append(frames)
+
+        try:
+            while True:
+                try:
+                    payload = frames.get(timeout = 1)
+                except queue.Empty:
+                    payload = None
+
+                if payload is None: # keep the connection alive with a ping, which also detects closed connections
+                    self.wfile.write(b'\x89\x00')
+                else:
+                    self.wfile.write(websocket_header(len(payload)) + payload)
+                self.wfile.flush()
+
+        except OSError: # the client left
+            pass
+
+        finally:
+            with self.simulator.lock:
+                self.simulator.clients.remove(frames)
+            self.close_connection = True
+
+def websocket_header(length):
+    '''Header of an unmasked text frame (server frames are never masked).'''
+
+    if length < 126:
+        return struct.pack('!BB', 0x81, length)
+    if length < 1 << 16:
+        return struct.pack('!BBH', 0x81, 126, length)
+    return struct.pack('!BBQ', 0x81, 127, length)
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Simulate the readers\' backend.')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--devices', type = int, default = 4)
+    parser.add_argument('--channels', type = int, default = 8)
+    parser.add_argument('--speed', type = float, default = 1, help = 'how much faster than real time to measure')
+    parser.add_argument('--noise', type = float, default = 0.002, help = 'standard deviation of the OD')
+    parser.add_argument('--outliers', type = float, default = 0.01, help = 'probability of a spike in each reading')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--users', nargs = '+', default = ['Avik'])
+    args = parser.parse_args()
+
+    simulator = reader_simulator(args.port, args.devices, args.channels, args.speed, args.noise, args.outliers,
+                                 args.seed, args.users)
+    try:
+        simulator.serve()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
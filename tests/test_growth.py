@@ -0,0 +1,21 @@
+import numpy as np
+
+from growth import growth_filter
+
+def test_invalid_ods_are_skipped():
+
+    times = np.arange(100) * 60.
+    ods = 0.01 * 2 ** (times / 60 / 30)
+
+    reference = growth_filter(1)
+    expected_ods, expected_growth_rates = reference.update(np.zeros(100), times, ods)
+
+    # The same measurements, with a missing and a NaN OD in between
+    estimates = growth_filter(1)
+    estimates.update(np.zeros(50), times[:50], ods[:50])
+    filtered_ods, growth_rates = estimates.update([0, 0, 0], [times[49] + 20, times[49] + 40, times[50]],
+                                                  [None, np.nan, ods[50]])
+    assert np.isfinite(growth_rates).all()
+
+    filtered_ods, growth_rates = estimates.update(np.zeros(49), times[51:], ods[51:])
+    assert np.allclose(growth_rates, expected_growth_rates[51:])
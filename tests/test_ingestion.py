@@ -0,0 +1,32 @@
+import mem
+from ingestion import close_hosts
+
+class fake_api:
+    '''Records the calls, failing to list the samples if the host is unreachable.'''
+
+    def __init__(self, reachable):
+        self.reachable = reachable
+        self.removed = False
+        self.closed = False
+
+    def samples(self):
+        if not self.reachable:
+            raise ConnectionError('unreachable')
+        return []
+
+    def remove_sample(self, samples):
+        self.removed = True
+
+    def close(self):
+        self.closed = True
+
+def test_unreachable_host_does_not_stop_the_cleanup(monkeypatch):
+
+    apis = {'first': fake_api(reachable = False), 'second': fake_api(reachable = True)}
+    monkeypatch.setattr(mem, 'apis', apis)
+    monkeypatch.setattr(mem, 'experiments', {})
+
+    close_hosts()
+
+    assert apis['second'].removed
+    assert all(api.closed for api in apis.values())
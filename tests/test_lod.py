@@ -0,0 +1,46 @@
+import threading
+import time
+
+import numpy as np
+
+from recording import stored_series
+
+def test_render_while_points_are_added():
+    '''The plots are rendered from the window's thread while the recorder adds points.'''
+
+    series = stored_series(memory_points = 2000)
+    stop = threading.Event()
+
+    def record():
+        t = 0
+        while not stop.is_set():
+            n = 1 + t % 50
+            times = np.arange(t, t + n, dtype = float)
+            if n == 1:
+                series.append(times[0], times[0])
+            else:
+                series.extend(times, times) # the value of each point is its time
+            t += n
+
+    recorder = threading.Thread(target = record)
+    recorder.start()
+
+    errors = []
+    deadline = time.monotonic() + 2
+    try:
+        while time.monotonic() < deadline:
+            size = series.size
+            if not size:
+                continue
+
+            last_time = series.last(size)[0]
+            for t_start, t_end in [(None, None), (last_time / 2, None), (last_time / 4, last_time / 2)]:
+                times, values = series.render(500, t_start, t_end, size)
+                if len(times) != len(values) or np.any(np.diff(times) < 0) or np.any(times > last_time) \
+                   or not np.array_equal(times, values):
+                    errors.append((size, t_start, t_end))
+    finally:
+        stop.set()
+        recorder.join()
+
+    assert not errors
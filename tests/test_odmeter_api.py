@@ -0,0 +1,66 @@
+from odmeter_api import ODMeterSystem
+
+class fake_response:
+    status_code = 200
+    text = ''
+
+    def __init__(self, body = None):
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError
+        return self.body
+
+def fake_api(reply = lambda samples: None):
+    '''An API client that does not connect to a backend. <reply> gives the body of the answer to the samples posted.
+    Returns the client, and the list of the samples it posts.'''
+
+    api = ODMeterSystem.__new__(ODMeterSystem)
+    api._user = 'Avik'
+    posted = []
+
+    def request(method, path, json = None, **kwargs):
+        posted.extend(json)
+        return fake_response(reply(json))
+
+    api._request = request
+    return api, posted
+
+def posted_samples(*args, **kwargs):
+    '''The samples that create_samples sends to the backend.'''
+
+    api, posted = fake_api()
+    api.create_samples(*args, **kwargs)
+
+    return posted
+
+def test_bulk_samples_match_single_samples():
+
+    devices = ['dev1', 'dev1', 'dev2']
+    channels = [0, 1, 0]
+    names = ['a', 'b', 'c']
+    curves = ['Ecoli'] * 3
+
+    single = []
+    for device, channel, name, curve in zip(devices, channels, names, curves):
+        single += posted_samples(device, channel, name, curve)
+
+    assert posted_samples(devices, channels, names, curves) == single
+    assert all(sample['user'] == 'Avik' for sample in single)
+
+def created(samples):
+    return [{**sample, 'uuid': f'uuid{i}'} for i, sample in enumerate(samples)]
+
+def test_samples_are_only_returned_when_all_were_created():
+
+    args = (['dev1', 'dev1'], [1, 2], ['a', 'b'], ['Ecoli'] * 2)
+
+    api, posted = fake_api(created)
+    samples = api.create_samples(*args)
+    assert [(sample.device, sample.channel) for sample in samples] == [('dev1', 1), ('dev1', 2)]
+
+    for reply in [lambda samples: [], lambda samples: created(samples)[:1],
+                  lambda samples: created(samples)[::-1]]:
+        api, posted = fake_api(reply)
+        assert api.create_samples(*args) is None
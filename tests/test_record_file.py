@@ -0,0 +1,69 @@
+import pytest
+
+from record_file import HEADERS, create_record, record_writer, load_record, read_history, parse_time
+
+def rows(start, n):
+    '''Rows of one culture, one per minute from minute <start>.'''
+
+    times = [f'2024-01-01T00:{minute:02d}:00+00:00' for minute in range(start, start + n)]
+    return [(time, 'dev', 0, 'culture', 1, 1, 0.1, 0.01 * minute, '', False) for minute, time in enumerate(times)], \
+           [parse_time(time) for time in times]
+
+def record_session(file_path, start, n, columnar):
+
+    writer = record_writer(file_path, columnar = columnar)
+    writer.start()
+    writer.write(*rows(start, n))
+    writer.close()
+
+def test_columnar_sessions_are_read_back(tmp_path):
+
+    pytest.importorskip('pyarrow')
+    file_path = str(tmp_path / 'record.tsv')
+    create_record(file_path)
+    record_session(file_path, 0, 5, columnar = True)
+    record_session(file_path, 5, 5, columnar = True)
+
+    assert len(load_record(file_path)) == 10
+
+def test_sessions_without_columnar_output_are_not_dropped(tmp_path):
+
+    pytest.importorskip('pyarrow')
+    file_path = str(tmp_path / 'record.tsv')
+    create_record(file_path)
+    record_session(file_path, 0, 5, columnar = True)
+    record_session(file_path, 5, 5, columnar = False)
+
+    data = load_record(file_path)
+    assert len(data) == 10
+    assert data['time'].iloc[-1] == parse_time('2024-01-01T00:09:00+00:00')
+
+def test_history_reads_rows_without_annotation(tmp_path):
+
+    file_path = str(tmp_path / 'record.tsv')
+    with open(file_path, 'w') as file:
+        file.write('\t'.join(HEADERS[:9]) + '\n')
+        file.write('2024-01-01T00:00:00+00:00\tdev\t0\tculture\t1\t1\t0.1\t0.01\t\n')
+        file.write('2024-01-01T00:01:00+00:00\tdev\t0\tculture\t1\t1\t0.1\t0.02\n') # 8 fields, no annotation
+
+    times, ods, outliers = read_history(file_path, {('dev', 0, 'culture')})[('dev', 0, 'culture')]
+    assert ods.tolist() == [0.01, 0.02]
+    assert not outliers.any()
+
+def test_unwritable_record_file_fails_on_creation(tmp_path):
+
+    with pytest.raises(OSError):
+        record_writer(str(tmp_path / 'missing' / 'record.tsv'))
+
+def test_write_fails_once_the_writer_stopped(tmp_path):
+
+    file_path = str(tmp_path / 'record.tsv')
+    create_record(file_path)
+    writer = record_writer(file_path)
+    writer.start()
+    writer.write([None], [0]) # not a row: stops the thread
+    writer.join()
+
+    with pytest.raises(OSError):
+        writer.write(*rows(0, 1))
+    writer.close()
@@ -0,0 +1,81 @@
+import math
+
+import pytest
+
+import mem
+from record_file import create_record
+from ingestion import reading
+from recording import recorder
+
+class scripted_recorder(recorder):
+    '''Records the given batches of readings, then stops.'''
+
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = list(batches)
+
+    def is_recording(self):
+        return bool(self.batches)
+
+    def request_data(self, timeout = 1):
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+def setup_device(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(mem.config, 'simulation', False)
+    monkeypatch.setattr(mem, 'devices', ['dev'])
+    monkeypatch.setattr(mem, 'channels', [0])
+    monkeypatch.setattr(mem, 'device_hosts', {'dev': ('host', 'dev')})
+    monkeypatch.setattr(mem, 'active_devices', [])
+    monkeypatch.setattr(mem, 'experiments', {})
+    monkeypatch.setattr(mem, 'cultures', {})
+    monkeypatch.setattr(mem, 'file_path', str(tmp_path / 'record.tsv'))
+    create_record(mem.file_path)
+
+def test_invalid_ods_are_not_flagged(tmp_path, monkeypatch):
+
+    setup_device(tmp_path, monkeypatch)
+
+    ods = [0.01 * 1.01 ** i for i in range(40)]
+    ods[20] = None
+    ods[30] = math.nan
+    batches = [[reading(f'2024-01-01T00:{i:02d}:00+00:00', 'dev', 1, od, 0, 0, od)] for i, od in enumerate(ods)]
+
+    rec = scripted_recorder(batches)
+    rec.initialize_cultures({('dev', 0): 'culture'})
+    rec.record() # raises if an invalid OD reaches the outlier detection
+
+    reactor = mem.cultures['dev'][0]
+    assert reactor.size == len(ods)
+    assert reactor.outliers.update(0.01 * 1.01 ** 40) is False # the detection still works afterwards
+
+    flags = [line.rstrip('\n').split('\t')[-1] for line in open(mem.file_path).readlines()[1:]]
+    assert flags[20] == flags[30] == 'False'
+
+def test_rows_are_written_when_recording_fails(tmp_path, monkeypatch):
+
+    setup_device(tmp_path, monkeypatch)
+
+    rec = scripted_recorder([[reading('2024-01-01T00:00:00+00:00', 'dev', 1, 0.01, 0, 0, 0.01)],
+                             RuntimeError('reader failed')])
+    rec.initialize_cultures({('dev', 0): 'culture'})
+    with pytest.raises(RuntimeError):
+        rec.record()
+
+    assert not mem.running
+    assert len(open(mem.file_path).readlines()) == 2
+
+def test_stop_during_startup_is_kept(tmp_path, monkeypatch):
+
+    setup_device(tmp_path, monkeypatch)
+    monkeypatch.setattr(mem, 'running', False) # e.g. Ctrl-C while the backend was starting
+
+    rec = recorder()
+    rec.initialize_cultures({('dev', 0): 'culture'})
+    rec.request_data = lambda timeout = 1: pytest.fail('the recording loop started')
+    rec.record()
+
+    assert not mem.running
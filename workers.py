@@ -0,0 +1,61 @@
+#!/bin/env python3
+'''Run blocking calls (network, backend API) on a thread pool, so that the window stays responsive.'''
+
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+class worker_signals(QObject):
+    '''Signals must live on a QObject, which QRunnable is not.'''
+
+    progress = pyqtSignal(str) # message describing the current step
+    finished = pyqtSignal(object) # return value of the function
+    failed = pyqtSignal(str) # error message
+
+class worker(QRunnable):
+    '''Call <function> on the global thread pool. The function receives a <progress> keyword argument, which it can
+    call with a message to report what it is doing. The signals are delivered on the GUI thread.'''
+
+    running = set() # keep the workers alive until they are done
+
+    def __init__(self, function, *args, **kwargs):
+
+        super().__init__()
+
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = worker_signals()
+
+    def run(self):
+
+        try:
+            result = self.function(*self.args, progress = self.signals.progress.emit, **self.kwargs)
+
+        except Exception as error:
+            traceback.print_exc()
+            self.signals.failed.emit(f'{type(error).__name__}: {error}')
+
+        else:
+            self.signals.finished.emit(result)
+
+def run_in_background(function, *args, on_finished = None, on_failed = None, on_progress = None, **kwargs):
+    '''Start <function> on the thread pool and connect the callbacks to its signals.'''
+
+    task = worker(function, *args, **kwargs)
+
+    if on_finished:
+        task.signals.finished.connect(on_finished)
+    if on_failed:
+        task.signals.failed.connect(on_failed)
+    if on_progress:
+        task.signals.progress.connect(on_progress)
+
+    # Release the worker once its last signal has been delivered
+    task.signals.finished.connect(lambda result: worker.running.discard(task))
+    task.signals.failed.connect(lambda message: worker.running.discard(task))
+
+    worker.running.add(task)
+    QThreadPool.globalInstance().start(task)
+
+    return task